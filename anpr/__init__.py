@@ -1,4 +1,16 @@
-from .anpr import detect_and_ocr
-from .classify import detect_vehicle
+from importlib import import_module
 
-__all__ = ["detect_and_ocr", "detect_vehicle"]
+from .result import FailureReason, PlateResult
+
+__all__ = ["detect_and_ocr", "recognize_plate", "detect_vehicle", "FailureReason", "PlateResult"]
+
+# Imported on first use: these load the YOLO models, which submodules such as
+# ocr (run in the CLI's worker processes) must not pay for
+_LAZY = {"detect_and_ocr": ".anpr", "recognize_plate": ".anpr", "detect_vehicle": ".classify"}
+
+def __getattr__(name):
+    if name not in _LAZY:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(import_module(_LAZY[name], __name__), name)
+    globals()[name] = value
+    return value
@@ -2,36 +2,96 @@
 ANPR — Automatic Number Plate Recognition Library
 
 Public API:
+    recognize_plate(image_input) -> PlateResult
     detect_and_ocr(image_input)
+    apply_ocr(result, best)   # for callers running detection and OCR themselves
 """
 
-from .detect import load_image, detect_plate_region
-from .ocr import preprocess_and_ocr
+import time
+
+from .detect import load_image, detect_plate
+from .ocr import PSMS, VARIANTS, ocr_plate
+from .result import FailureReason, PlateResult
 from .utils import PLATE_REGEX
 
-def detect_and_ocr(image_input):
+def recognize_plate(image_input, imgsz=None, variants=VARIANTS, psms=PSMS, camera=None,
+                    tiling=None):
     """
     Detects and recognizes license plate from an image.
     Accepts:
-        - File path or base64 image string.
+        - File path, base64 image string or encoded image bytes.
+        - Optional YOLO input size and OCR variants/psms, to trade accuracy for speed.
+        - Optional CameraProfile, to detect within that camera's region of interest.
+        - Optional detect.Tiling, to detect in tiles on high-resolution frames.
     Returns:
-        - License plate text if valid
-        - "Invalid plate" otherwise
+        - PlateResult with the plate text, bbox, confidences, winning OCR
+          variant/psm, per-stage timings, and a failure reason if it failed.
+    Never raises; errors are reported through the result.
     """
+    result = PlateResult()
+    timings = result.timings
+
+    t = time.perf_counter()
     try:
         img = load_image(image_input)
-        if img is None:
-            return "Invalid plate"
+    except Exception as e:
+        img, result.error = None, str(e)
+    timings["decode"] = time.perf_counter() - t
+    if img is None:
+        result.failure = FailureReason.DECODE_FAILED
+        return result
+
+    t = time.perf_counter()
+    try:
+        if camera is None:
+            plate_crop, result.bbox, result.det_conf = detect_plate(img, imgsz, tiling=tiling)
+        else:
+            plate_crop, result.bbox, result.det_conf, result.roi = camera.detect(
+                img, lambda view: detect_plate(view, imgsz, tiling=tiling))
+    except Exception as e:
+        result.failure, result.error = FailureReason.DETECT_ERROR, str(e)
+        return result
+    finally:
+        timings["detect"] = time.perf_counter() - t
+    if plate_crop is None or plate_crop.size == 0:
+        result.failure = FailureReason.NO_PLATE
+        return result
+
+    t = time.perf_counter()
+    try:
+        best = ocr_plate(plate_crop, variants, psms)
+    except Exception as e:
+        result.failure, result.error = FailureReason.OCR_ERROR, str(e)
+        return result
+    finally:
+        timings["ocr"] = time.perf_counter() - t
+    apply_ocr(result, best)
+    return result
 
-        plate_crop = detect_plate_region(img)
-        if plate_crop is None:
-            return "Invalid plate"
 
-        best_plate = preprocess_and_ocr(plate_crop)
-        return best_plate if best_plate and PLATE_REGEX.match(best_plate) else "Invalid plate"
+def apply_ocr(result, best):
+    """Fill `result` from an ocr_plate() return value."""
+    if best is None:
+        result.failure = FailureReason.NO_TEXT
+        return
+    text, result.ocr_conf, result.variant, result.psm = best
+    if PLATE_REGEX.match(text):
+        result.text = text
+    else:
+        result.failure, result.error = FailureReason.INVALID_FORMAT, f"read '{text}'"
 
-    except Exception:
-        return "Invalid plate"
+
+def detect_and_ocr(image_input):
+    """
+    Detects and recognizes license plate from an image.
+    Accepts:
+        - File path or base64 image string.
+    Returns:
+        - License plate text if valid
+        - "Invalid plate" otherwise
+    """
+    result = recognize_plate(image_input)
+    return result.text if result.ok else "Invalid plate"
 
 
 if __name__ == "__main__":
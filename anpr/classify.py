@@ -1,44 +1,85 @@
-import cv2
-import numpy as np
-import base64
 import os
 from ultralytics import YOLO
+from .detect import load_image, predict
 
 _CLASSIFY_MODEL_PATH = os.path.join(os.path.dirname(__file__), "models", "yolo11n.pt")
 _model = YOLO(_CLASSIFY_MODEL_PATH)  
 
-def _load_image(image_input):
-    """Load an image from a file path or base64 string."""
-    if isinstance(image_input, str) and os.path.exists(image_input):
-        return cv2.imread(image_input)
-    else:
-        img_bytes = base64.b64decode(image_input.split(",")[-1])
-        np_arr = np.frombuffer(img_bytes, np.uint8)
-        return cv2.imdecode(np_arr, cv2.IMREAD_COLOR)
+# COCO classes we care about; everything else is dropped at inference time
+VEHICLE_CLASSES = {2: "car", 3: "bike"}
+# Telling a car from a bike needs far less resolution than finding a plate
+CLASSIFY_IMGSZ = 320
 
-def detect_vehicle(image_input):
+# Plate width / height: single-row car plates are ~4.7:1, two-row bike plates ~2:1
+CAR_PLATE_RATIO = 3.2
+BIKE_PLATE_RATIO = 2.4
+
+def vehicle_from_plate(plate_bbox):
+    """'car' or 'bike' from the plate's aspect ratio, or None when it is ambiguous."""
+    x1, y1, x2, y2 = plate_bbox
+    if y2 <= y1:
+        return None
+    ratio = (x2 - x1) / (y2 - y1)
+    if ratio >= CAR_PLATE_RATIO:
+        return "car"
+    if ratio <= BIKE_PLATE_RATIO:
+        return "bike"
+    return None
+
+def _plate_region(shape, plate_bbox):
+    """Region around a plate where its vehicle should be: mostly above and beside it."""
+    h, w = shape[:2]
+    x1, y1, x2, y2 = plate_bbox
+    pw = x2 - x1
+    return (max(0, x1 - 3 * pw), max(0, y1 - 4 * pw),
+            min(w, x2 + 3 * pw), min(h, y2 + pw))
+
+def detect_vehicle(image_input, model=None, plate_bbox=None, from_plate=False,
+                   imgsz=CLASSIFY_IMGSZ):
     """
-    Detects vehicles in an image.
+    Detects vehicles in an image, with the live model unless another is given.
+    Accepts a file path, base64 string, image bytes or a decoded image.
+    With `plate_bbox`, looks only at the region around that plate and prefers
+    the vehicle box containing it; with `from_plate` too, answers from the
+    plate's shape alone when that is unambiguous, skipping the model.
     Returns:
         - 'car' if class_id == 2
         - 'bike' if class_id == 3
         - None if no relevant object detected
     """
-    img = _load_image(image_input)
+    if from_plate and plate_bbox is not None:
+        vehicle = vehicle_from_plate(plate_bbox)
+        if vehicle is not None:
+            return vehicle
+
+    img = load_image(image_input)
     if img is None:
         raise ValueError("Could not read the image.")
 
-    results = _model(img, verbose=False)
-    for r in results:
-        for box in r.boxes:
-            class_id = int(box.cls[0])
-            if class_id == 2:
-                return "car"
-            elif class_id == 3:
-                return "bike"
-            else:
-                return None
-    return None
+    ox, oy = 0, 0
+    if plate_bbox is not None:
+        ox, oy, rx2, ry2 = _plate_region(img.shape, plate_bbox)
+        img = img[oy:ry2, ox:rx2]
+
+    results = predict(model or _model, img, classes=list(VEHICLE_CLASSES), imgsz=imgsz,
+                      verbose=False)
+    if not results or len(results[0].boxes) == 0:
+        return None
+    boxes = results[0].boxes
+    xyxy = boxes.xyxy.cpu().numpy()
+    conf = boxes.conf.cpu().numpy()
+    cls = boxes.cls.cpu().numpy().astype(int)
+
+    candidates = range(len(cls))
+    if plate_bbox is not None:
+        # The plate's vehicle is the box around the plate centre, if any
+        cx = (plate_bbox[0] + plate_bbox[2]) / 2 - ox
+        cy = (plate_bbox[1] + plate_bbox[3]) / 2 - oy
+        around = [i for i in candidates
+                  if xyxy[i, 0] <= cx <= xyxy[i, 2] and xyxy[i, 1] <= cy <= xyxy[i, 3]]
+        candidates = around or candidates
+    best = max(candidates, key=lambda i: conf[i])
+    return VEHICLE_CLASSES.get(int(cls[best]))
 
 # Example usage
 if __name__ == "__main__":
@@ -0,0 +1,248 @@
+"""
+Batch command line interface for the ANPR library.
+
+Reads images from directories, globs or file lists, decodes them on a
+prefetching I/O thread, detects plates in batches and runs OCR on a process
+pool. Results are appended to a JSONL or CSV file as they complete; re-running
+with the same output file skips images that are already in it.
+
+Usage:
+    python -m anpr images/ -o results.jsonl
+    python -m anpr "archive/2024-*/**/*.jpg" -o results.csv --batch-size 16
+    python -m anpr --files-from list.txt -o results.jsonl
+"""
+
+import argparse
+import csv
+import glob
+import json
+import multiprocessing
+import os
+import queue
+import sys
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import cv2
+import numpy as np
+
+from .anpr import apply_ocr
+from .detect import detect_plate_regions
+from .ocr import timed_ocr_plate
+from .result import FailureReason, PlateResult
+
+IMAGE_EXTS = {".jpg", ".jpeg", ".png", ".bmp", ".webp"}
+FIELDS = ["path", "text", "failure", "bbox", "det_conf", "ocr_conf", "variant", "psm",
+          "error", "timings", "roi"]
+
+# ----------------------------
+# INPUTS
+# ----------------------------
+def expand_inputs(inputs, files_from=None, recursive=False):
+    """Yield image paths from files, directories, glob patterns and list files."""
+    sources = list(inputs)
+    if files_from:
+        stream = sys.stdin if files_from == "-" else open(files_from, "r")
+        with stream:
+            sources.extend(line.strip() for line in stream if line.strip())
+
+    for src in sources:
+        if os.path.isdir(src):
+            pattern = os.path.join(src, "**", "*") if recursive else os.path.join(src, "*")
+            for path in sorted(glob.iglob(pattern, recursive=recursive)):
+                if os.path.splitext(path)[1].lower() in IMAGE_EXTS:
+                    yield path
+        elif os.path.isfile(src):
+            yield src
+        else:
+            yield from sorted(glob.iglob(src, recursive=True))
+
+
+def _prefetch(paths, out, stop):
+    """I/O thread: read and decode images ahead of the detector."""
+    try:
+        for path in paths:
+            if stop.is_set():
+                break
+            t = time.perf_counter()
+            try:
+                with open(path, "rb") as f:
+                    data = np.frombuffer(f.read(), np.uint8)
+                # imdecode raises rather than returning None on an empty buffer
+                img = cv2.imdecode(data, cv2.IMREAD_COLOR) if data.size else None
+            except Exception:
+                img = None
+            out.put((path, img, time.perf_counter() - t))
+    finally:
+        out.put(None)  # always, or run() waits forever
+
+# ----------------------------
+# OUTPUT
+# ----------------------------
+class ResultWriter:
+    """Appends result rows to a JSONL or CSV file, flushing after each row."""
+
+    def __init__(self, path, fmt=None):
+        self.fmt = fmt or ("csv" if path.endswith(".csv") else "jsonl")
+        self.done = self._load_done(path)
+        new_file = not os.path.exists(path) or os.path.getsize(path) == 0
+        self._file = open(path, "a", newline="")
+        if self.fmt == "csv":
+            self._csv = csv.DictWriter(self._file, fieldnames=FIELDS)
+            if new_file:
+                self._csv.writeheader()
+
+    def _load_done(self, path):
+        """Paths already present in an existing output file."""
+        if not os.path.exists(path):
+            return set()
+        with open(path, "r", newline="") as f:
+            if self.fmt == "csv":
+                return {row["path"] for row in csv.DictReader(f)}
+            done = set()
+            for line in f:
+                try:
+                    done.add(json.loads(line)["path"])
+                except (ValueError, KeyError):
+                    continue  # a partially written last line
+            return done
+
+    def write(self, row):
+        if self.fmt == "csv":
+            self._csv.writerow({
+                **row,
+                "bbox": " ".join(map(str, row["bbox"] or ())),
+                "roi": " ".join(map(str, row["roi"] or ())),
+                "timings": json.dumps(row["timings"]),
+            })
+        else:
+            self._file.write(json.dumps(row) + "\n")
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+# ----------------------------
+# PIPELINE
+# ----------------------------
+def run(paths, writer, batch_size=8, workers=None, prefetch=32):
+    """
+    Process `paths`, skipping those already in `writer`.
+    Returns a {outcome: count} summary ("ok" or the failure reason).
+    """
+    def todo():
+        seen = set(writer.done)
+        for p in paths:
+            if p not in seen:
+                seen.add(p)
+                yield p
+
+    frames = queue.Queue(maxsize=prefetch)
+    stop = threading.Event()
+    reader = threading.Thread(target=_prefetch, args=(todo(), frames, stop), daemon=True)
+    reader.start()
+
+    summary = {}
+
+    def emit(path, result):
+        writer.write({"path": path, **result.to_dict()})
+        outcome = result.failure.value if result.failure else "ok"
+        summary[outcome] = summary.get(outcome, 0) + 1
+
+    def drain(futures, block):
+        finished, _ = wait(futures, timeout=None if block else 0, return_when=FIRST_COMPLETED)
+        for future in finished:
+            path, result = futures.pop(future)
+            try:
+                best, result.timings["ocr"] = future.result()
+                apply_ocr(result, best)
+            except Exception as e:
+                result.failure, result.error = FailureReason.OCR_ERROR, str(e)
+            emit(path, result)
+
+    # Not forked: this process already runs torch and the reader thread
+    pool = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn"))
+    futures = {}
+    max_in_flight = 4 * (workers or os.cpu_count() or 1)
+    try:
+        finished = False
+        while not finished:
+            batch = []
+            while len(batch) < batch_size:
+                item = frames.get()
+                if item is None:
+                    finished = True
+                    break
+                path, img, decode_time = item
+                result = PlateResult(timings={"decode": decode_time})
+                if img is None:
+                    result.failure = FailureReason.DECODE_FAILED
+                    emit(path, result)
+                else:
+                    batch.append((path, img, result))
+
+            if batch:
+                t = time.perf_counter()
+                try:
+                    detections = detect_plate_regions([img for _, img, _ in batch])
+                except Exception as e:
+                    detections = [e] * len(batch)
+                # Batch time, amortized over its images
+                detect_time = (time.perf_counter() - t) / len(batch)
+
+                for (path, _, result), detection in zip(batch, detections):
+                    result.timings["detect"] = detect_time
+                    if isinstance(detection, Exception):
+                        result.failure, result.error = FailureReason.DETECT_ERROR, str(detection)
+                        emit(path, result)
+                        continue
+                    crop, result.bbox, result.det_conf = detection
+                    if crop is None or crop.size == 0:
+                        result.failure = FailureReason.NO_PLATE
+                        emit(path, result)
+                    else:
+                        futures[pool.submit(timed_ocr_plate, crop)] = (path, result)
+
+            # Write whatever finished; block only to bound memory
+            drain(futures, block=False)
+            while len(futures) > max_in_flight:
+                drain(futures, block=True)
+
+        while futures:
+            drain(futures, block=True)
+    finally:
+        stop.set()
+        pool.shutdown(cancel_futures=True)
+
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m anpr",
+                                     description="Recognize number plates in bulk.")
+    parser.add_argument("inputs", nargs="*", help="image files, directories or glob patterns")
+    parser.add_argument("--files-from", metavar="FILE", help="read paths from FILE ('-' for stdin)")
+    parser.add_argument("-r", "--recursive", action="store_true", help="recurse into directories")
+    parser.add_argument("-o", "--output", default="results.jsonl",
+                        help="JSONL or CSV results file; existing entries are skipped")
+    parser.add_argument("--format", choices=["jsonl", "csv"], help="default: from the extension")
+    parser.add_argument("--batch-size", type=int, default=8, help="images per detector call")
+    parser.add_argument("--workers", type=int, default=None, help="OCR processes")
+    parser.add_argument("--prefetch", type=int, default=32, help="decoded images buffered ahead")
+    args = parser.parse_args(argv)
+
+    if not args.inputs and not args.files_from:
+        parser.error("no inputs given")
+
+    writer = ResultWriter(args.output, args.format)
+    if writer.done:
+        print(f"Resuming: {len(writer.done)} images already in {args.output}", file=sys.stderr)
+    try:
+        paths = expand_inputs(args.inputs, args.files_from, args.recursive)
+        summary = run(paths, writer, args.batch_size, args.workers, args.prefetch)
+    finally:
+        writer.close()
+
+    print(", ".join(f"{k}: {v}" for k, v in sorted(summary.items())) or "Nothing to do.",
+          file=sys.stderr)
@@ -0,0 +1,44 @@
+"""
+Single-flight coalescing of identical in-flight requests.
+
+When the same frame arrives several times at once (e.g. from multiple
+relays), only the first copy is computed; the others wait for it and share
+its result. Nothing is kept once the computation finishes: this is not a
+cache, it only removes duplicate concurrent work.
+"""
+
+import asyncio
+import hashlib
+
+
+def content_key(image):
+    """Hash of the image payload (base64, ignoring any data-URL prefix, or raw bytes)."""
+    if isinstance(image, str):
+        image = image.split(",")[-1].encode()
+    return hashlib.sha1(image).hexdigest()
+
+
+class SingleFlight:
+    """Shares one running computation between concurrent callers with the same key."""
+
+    def __init__(self):
+        self._flights = {}
+        self.computed = 0   # computations started
+        self.coalesced = 0  # callers that joined one instead
+
+    async def run(self, key, factory):
+        """Return the result of `await factory()`, shared with concurrent callers of `key`."""
+        task = self._flights.get(key)
+        if task is None:
+            task = asyncio.ensure_future(factory())
+            self._flights[key] = task
+            task.add_done_callback(lambda _: self._flights.pop(key, None))
+            self.computed += 1
+        else:
+            self.coalesced += 1
+        # Shielded: one caller going away must not cancel the others' result
+        return await asyncio.shield(task)
+
+    def stats(self):
+        return {"computed": self.computed, "coalesced": self.coalesced,
+                "in_flight": len(self._flights)}
@@ -2,26 +2,156 @@ import cv2
 import numpy as np
 import base64
 import os
+import threading
+import weakref
+from dataclasses import dataclass
 from ultralytics import YOLO
 
 # Load YOLO model
 _MODEL_PATH = os.path.join(os.path.dirname(__file__), "models/license_plate_detector.pt")
 _YOLO_MODEL = YOLO(_MODEL_PATH)
 
+# Ultralytics predictors are not thread-safe: one call per model object at a time
+_MODEL_LOCKS = weakref.WeakKeyDictionary()
+_MODEL_LOCKS_LOCK = threading.Lock()
+
+def predict(model, source, **kwargs):
+    """Run a YOLO model on `source`, waiting for any other thread using the same model."""
+    with _MODEL_LOCKS_LOCK:
+        lock = _MODEL_LOCKS.setdefault(model, threading.Lock())
+    with lock:
+        return model(source, **kwargs)
+
 def load_image(image_input):
-    """Load an image from a file path or base64 string."""
+    """Load an image from a file path, base64 string or encoded image bytes (arrays pass through)."""
+    if isinstance(image_input, np.ndarray):
+        return image_input
+    if isinstance(image_input, (bytes, bytearray)):
+        return _decode(image_input)
     if isinstance(image_input, str) and os.path.exists(image_input):
         return cv2.imread(image_input)
     else:
-        img_bytes = base64.b64decode(image_input.split(",")[-1])
-        np_arr = np.frombuffer(img_bytes, np.uint8)
-        return cv2.imdecode(np_arr, cv2.IMREAD_COLOR)
+        return _decode(base64.b64decode(image_input.split(",")[-1]))
+
+def _decode(data):
+    """Decode encoded image bytes; None when empty (imdecode raises on an empty buffer)."""
+    if not data:
+        return None
+    return cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+
+def _first_box(result):
+    """Pixel bbox (x1, y1, x2, y2) and confidence of the top detection, or (None, None)."""
+    if result is None or len(result.boxes) == 0:
+        return None, None
+    box = result.boxes[0]
+    bbox = tuple(int(v) for v in box.xyxy[0].cpu().numpy().astype(int))
+    return bbox, float(box.conf[0])
+
+def _predict_kwargs(imgsz):
+    # Only override the model's input size when asked to
+    return {"verbose": False} if imgsz is None else {"verbose": False, "imgsz": imgsz}
+
+@dataclass(frozen=True)
+class Tiling:
+    """
+    Tiled detection for high-resolution frames: frames of at least `min_pixels`
+    are cut into `size` px square tiles overlapping by `overlap`, so small
+    distant plates aren't shrunk away by YOLO's resize of the whole frame.
+    """
+    size: int = 1280
+    overlap: float = 0.2
+    min_pixels: int = 8_000_000  # ~4K
+
+    def applies(self, shape):
+        return shape[0] * shape[1] >= self.min_pixels
+
+    def tiles(self, shape):
+        """Tile rectangles (x1, y1, x2, y2) covering a frame of `shape`."""
+        h, w = shape[:2]
+        stride = max(1, int(self.size * (1 - self.overlap)))
+
+        def starts(length):
+            if length <= self.size:
+                return [0]
+            out = list(range(0, length - self.size, stride))
+            return out + [length - self.size]  # last tile flush with the edge
+
+        return [(x, y, min(x + self.size, w), min(y + self.size, h))
+                for y in starts(h) for x in starts(w)]
+
+def _merge_boxes(boxes, confs, threshold=0.6):
+    """
+    Merge detections of the same plate from overlapping tiles. Overlap is
+    measured against the smaller box, so a plate cut off at a tile edge
+    groups with the whole plate from the next tile whichever scores higher;
+    each group becomes the union of its boxes with the group's best
+    confidence. Returns (boxes, confs), best first.
+    """
+    order = np.argsort(-confs)
+    areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    merged, merged_confs = [], []
+    while order.size:
+        i, rest = order[0], order[1:]
+        iw = np.clip(np.minimum(boxes[i, 2], boxes[rest, 2]) - np.maximum(boxes[i, 0], boxes[rest, 0]), 0, None)
+        ih = np.clip(np.minimum(boxes[i, 3], boxes[rest, 3]) - np.maximum(boxes[i, 1], boxes[rest, 1]), 0, None)
+        smaller = np.maximum(np.minimum(areas[i], areas[rest]), 1)
+        same = iw * ih / smaller >= threshold
+        group = boxes[np.r_[i, rest[same]]]
+        merged.append(np.r_[group[:, :2].min(axis=0), group[:, 2:].max(axis=0)])
+        merged_confs.append(confs[i])
+        order = rest[~same]
+    return np.array(merged), np.array(merged_confs)
+
+def _detect_tiled(img, tiling, imgsz=None, model=None):
+    """Top (bbox, conf) over all tiles of `img`, run as one batch, or (None, None)."""
+    rects = tiling.tiles(img.shape)
+    results = predict(model or _YOLO_MODEL, [img[y1:y2, x1:x2] for x1, y1, x2, y2 in rects],
+                      **_predict_kwargs(imgsz))
+    boxes, confs = [], []
+    for (x1, y1, _, _), result in zip(rects, results):
+        if len(result.boxes) == 0:
+            continue
+        boxes.append(result.boxes.xyxy.cpu().numpy() + (x1, y1, x1, y1))
+        confs.append(result.boxes.conf.cpu().numpy())
+    if not boxes:
+        return None, None
+    boxes, confs = _merge_boxes(np.concatenate(boxes), np.concatenate(confs))
+    return tuple(int(v) for v in boxes[0]), float(confs[0])
+
+def detect_plate(img, imgsz=None, model=None, tiling=None):
+    """
+    Detect the license plate in an image, optionally at a smaller YOLO input size,
+    with another model than the live one, or in tiles when `tiling` applies to it.
+    Returns (crop, bbox, confidence), or (None, None, None) when nothing was found.
+    """
+    if tiling is not None and tiling.applies(img.shape):
+        bbox, conf = _detect_tiled(img, tiling, imgsz, model)
+    else:
+        results = predict(model or _YOLO_MODEL, img, **_predict_kwargs(imgsz))
+        bbox, conf = _first_box(results[0] if results else None)
+    if bbox is None:
+        return None, None, None
+    x1, y1, x2, y2 = bbox
+    return img[y1:y2, x1:x2], bbox, conf
 
 def detect_plate_region(img):
     """Detect license plate in image using YOLO model."""
-    results = _YOLO_MODEL(img, verbose=False)
-    if not results or len(results[0].boxes) == 0:
-        return None
-    box = results[0].boxes[0].xyxy[0].cpu().numpy().astype(int)
-    x1, y1, x2, y2 = box
-    return img[y1:y2, x1:x2]
+    return detect_plate(img)[0]
+
+def detect_plate_regions(imgs, imgsz=None):
+    """
+    Batched detect_plate: one YOLO call for a list of images.
+    Returns a (crop, bbox, confidence) triple per image.
+    """
+    if not imgs:
+        return []
+    results = predict(_YOLO_MODEL, list(imgs), **_predict_kwargs(imgsz))
+    out = []
+    for img, result in zip(imgs, results):
+        bbox, conf = _first_box(result)
+        if bbox is None:
+            out.append((None, None, None))
+        else:
+            x1, y1, x2, y2 = bbox
+            out.append((img[y1:y2, x1:x2], bbox, conf))
+    return out
@@ -0,0 +1,147 @@
+"""
+Durable job queue for bulk recognition requests.
+
+Jobs and their items live in a local SQLite database in WAL mode, so
+submitted work survives restarts: items that were being processed when the
+process died are put back in the queue by `recover()`. Workers claim items
+one at a time, and each completion gets a sequence number so clients can
+stream results in the order they finish.
+"""
+
+import json
+import sqlite3
+import threading
+import time
+import uuid
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id       TEXT PRIMARY KEY,
+    created  REAL NOT NULL,
+    total    INTEGER NOT NULL,
+    queued   INTEGER NOT NULL,          -- items not yet claimed
+    priority INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS items (
+    job_id  TEXT NOT NULL,
+    idx     INTEGER NOT NULL,
+    status  TEXT NOT NULL,           -- queued / running / done
+    image   TEXT,                    -- input, dropped once done
+    result  TEXT,                    -- JSON, set once done
+    seq     INTEGER,                 -- completion order
+    PRIMARY KEY (job_id, idx)
+);
+CREATE INDEX IF NOT EXISTS jobs_queued ON jobs(queued, priority, created);
+CREATE INDEX IF NOT EXISTS items_status ON items(job_id, status, idx);
+CREATE INDEX IF NOT EXISTS items_seq ON items(job_id, seq);
+"""
+
+
+class JobQueue:
+    """Thread-safe SQLite-backed queue of recognition jobs."""
+
+    def __init__(self, path):
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+        self._lock = threading.Lock()
+        self._seq = self._conn.execute("SELECT COALESCE(MAX(seq), 0) FROM items").fetchone()[0]
+
+    def recover(self):
+        """Requeue items left running by a crashed process; returns how many."""
+        with self._lock:
+            self._conn.execute("BEGIN")
+            cur = self._conn.execute("UPDATE items SET status = 'queued' WHERE status = 'running'")
+            self._conn.execute(
+                "UPDATE jobs SET queued = (SELECT COUNT(*) FROM items "
+                "WHERE items.job_id = jobs.id AND items.status = 'queued')"
+            )
+            self._conn.execute("COMMIT")
+            return cur.rowcount
+
+    def submit(self, images, priority=0):
+        """Queue a batch of images; returns the new job id."""
+        job_id = uuid.uuid4().hex
+        with self._lock:
+            self._conn.execute("BEGIN")
+            self._conn.execute(
+                "INSERT INTO jobs (id, created, total, queued, priority) VALUES (?, ?, ?, ?, ?)",
+                (job_id, time.time(), len(images), len(images), priority),
+            )
+            self._conn.executemany(
+                "INSERT INTO items (job_id, idx, status, image) VALUES (?, ?, 'queued', ?)",
+                [(job_id, i, image) for i, image in enumerate(images)],
+            )
+            self._conn.execute("COMMIT")
+        return job_id
+
+    def claim(self):
+        """Take the next queued item (highest priority, oldest job first), or None."""
+        with self._lock:
+            while True:
+                job = self._conn.execute(
+                    "SELECT id FROM jobs WHERE queued > 0 ORDER BY priority DESC, created LIMIT 1"
+                ).fetchone()
+                if job is None:
+                    return None
+                row = self._conn.execute(
+                    "SELECT idx, image FROM items WHERE job_id = ? AND status = 'queued' "
+                    "ORDER BY idx LIMIT 1",
+                    (job["id"],),
+                ).fetchone()
+                if row is None:
+                    # The count drifted from the items; correct it and look again
+                    self._conn.execute("UPDATE jobs SET queued = 0 WHERE id = ?", (job["id"],))
+                    continue
+                self._conn.execute("BEGIN")
+                self._conn.execute(
+                    "UPDATE items SET status = 'running' WHERE job_id = ? AND idx = ?",
+                    (job["id"], row["idx"]),
+                )
+                self._conn.execute("UPDATE jobs SET queued = queued - 1 WHERE id = ?",
+                                   (job["id"],))
+                self._conn.execute("COMMIT")
+                return job["id"], row["idx"], row["image"]
+
+    def complete(self, job_id, idx, result):
+        """Store an item's result and release its input."""
+        with self._lock:
+            self._seq += 1
+            self._conn.execute(
+                "UPDATE items SET status = 'done', image = NULL, result = ?, seq = ? "
+                "WHERE job_id = ? AND idx = ?",
+                (json.dumps(result), self._seq, job_id, idx),
+            )
+
+    def status(self, job_id):
+        """{"job_id", "total", "done", "status"} or None for unknown jobs."""
+        with self._lock:
+            job = self._conn.execute(
+                "SELECT total FROM jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+            if job is None:
+                return None
+            done = self._conn.execute(
+                "SELECT COUNT(*) FROM items WHERE job_id = ? AND status = 'done'", (job_id,)
+            ).fetchone()[0]
+        return {
+            "job_id": job_id,
+            "total": job["total"],
+            "done": done,
+            "status": "done" if done == job["total"] else "pending",
+        }
+
+    def results(self, job_id, after_seq=0):
+        """Completed items finished after `after_seq`, as (seq, idx, result) in completion order."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT seq, idx, result FROM items "
+                "WHERE job_id = ? AND status = 'done' AND seq > ? ORDER BY seq",
+                (job_id, after_seq),
+            ).fetchall()
+        return [(r["seq"], r["idx"], json.loads(r["result"])) for r in rows]
+
+    def close(self):
+        self._conn.close()
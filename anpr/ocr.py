@@ -2,6 +2,7 @@ import cv2
 import pytesseract
 from PIL import Image
 import os
+import time
 from .utils import PLATE_REGEX, normalize_plate
 
 # Configure Tesseract
@@ -9,26 +10,43 @@ pytesseract.pytesseract.tesseract_cmd = r"/usr/bin/tesseract"
 
 # Path to local trained data
 _TESSDATA_DIR = os.path.join(os.path.dirname(__file__), "models/tessdata")
+# Directory Tesseract reads from; the model registry points it at a snapshot
+_tessdata_dir = _TESSDATA_DIR
 
-def _ocr_image(img, psm=7):
+def _ocr_image(img, psm=7, tessdata_dir=None):
+    """Run Tesseract; returns (text, mean word confidence 0-100 or None)."""
     pil_img = Image.fromarray(img)
     config = (
         f'--oem 3 --psm {psm} '
         '-c tessedit_char_whitelist=ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789 '
-        f'--tessdata-dir "{_TESSDATA_DIR}" '
+        f'--tessdata-dir "{tessdata_dir or _tessdata_dir}" '
         '-l plates'
     )
-    return pytesseract.image_to_string(pil_img, config=config).strip()
+    data = pytesseract.image_to_data(pil_img, config=config, output_type=pytesseract.Output.DICT)
+    words = [(w, float(c)) for w, c in zip(data["text"], data["conf"]) if w.strip()]
+    if not words:
+        return "", None
+    return "".join(w for w, _ in words), sum(c for _, c in words) / len(words)
 
 
-def preprocess_and_ocr(img):
-    """Preprocess image and perform OCR, returning best valid plate."""
+# Preprocessing variants and page segmentation modes tried by default
+VARIANTS = ("raw_gray", "adaptive")
+PSMS = (6, 7, 8)
+
+def ocr_plate(img, variants=VARIANTS, psms=PSMS, tessdata_dir=None):
+    """
+    Preprocess image and perform OCR over the given variants and page segmentation
+    modes (all of them by default; fewer is faster under load), optionally with
+    plates.traineddata from another directory than the live one.
+    Returns (text, confidence, variant, psm) for the longest valid plate, or
+    for the longest text read if none is valid; None if nothing was read.
+    """
     gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
     gray = cv2.resize(gray, None, fx=2, fy=2, interpolation=cv2.INTER_CUBIC)
 
-    variants = {
-        "raw_gray": gray,
-        "adaptive": cv2.adaptiveThreshold(
+    builders = {
+        "raw_gray": lambda: gray,
+        "adaptive": lambda: cv2.adaptiveThreshold(
             gray, 255,
             cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
             cv2.THRESH_BINARY,
@@ -37,15 +55,32 @@ def preprocess_and_ocr(img):
     }
 
     results = []
-    for variant_img in variants.values():
-        for psm in [6, 7, 8]:
-            raw = _ocr_image(variant_img, psm)
+    for name in variants:
+        variant_img = builders[name]()
+        for psm in psms:
+            raw, conf = _ocr_image(variant_img, psm, tessdata_dir)
             merged = normalize_plate(raw)
             if merged:
-                results.append(merged)
+                results.append((merged, conf, name, psm))
 
     if not results:
         return None
 
-    valid = [r for r in results if PLATE_REGEX.match(r)]
-    return max(valid, key=len) if valid else None
+    valid = [r for r in results if PLATE_REGEX.match(r[0])]
+    return max(valid or results, key=lambda r: len(r[0]))
+
+
+def timed_ocr_plate(img):
+    """
+    ocr_plate() and its duration in seconds. Process-pool entry point for
+    the batch CLI: workers import only this module, not the YOLO models.
+    """
+    t = time.perf_counter()
+    best = ocr_plate(img)
+    return best, time.perf_counter() - t
+
+
+def preprocess_and_ocr(img):
+    """Preprocess image and perform OCR, returning best valid plate."""
+    best = ocr_plate(img)
+    return best[0] if best and PLATE_REGEX.match(best[0]) else None
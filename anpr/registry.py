@@ -0,0 +1,342 @@
+"""
+Model registry: hot reload of the plate detector, the vehicle classifier and
+plates.traineddata while the server keeps running.
+
+Each model is watched through its file (the same paths the modules load at
+import). When a file changes and has stopped changing, or when `reload()` is
+called, the new version is loaded and warmed up on the calling (background)
+thread, then swapped in by rebinding the module global the recognition code
+reads on every call. Requests already running finish with the old model;
+nothing waits on the load.
+
+Tesseract reads plates.traineddata from disk on every call, so the live OCR
+reads from a snapshot copy in tessdata/versions/<sha1>/ rather than from the
+file that training overwrites in place.
+
+Shadow mode loads a candidate next to the live model and, for a sample of
+traffic, runs both on a background thread, recording how often they agree
+and how long each takes. That thread loads its own copy of the live YOLO
+models, so it never holds the lock live requests wait on, and it never
+affects the responses.
+"""
+
+import hashlib
+import os
+import random
+import shutil
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from ultralytics import YOLO
+
+from . import classify, detect, ocr
+
+_TRAINEDDATA = "plates.traineddata"
+_SNAPSHOT_DIR = os.path.join(ocr._TESSDATA_DIR, "versions")
+_SNAPSHOTS_KEPT = 3  # older snapshots may still be read by running OCR calls
+_SHADOW_BACKLOG = 4  # sampled requests waiting for the shadow thread; more are dropped
+_MODELS_DIR = os.path.realpath(os.path.dirname(detect._MODEL_PATH))  # shadow candidates live here
+
+
+def _sha1(path):
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _signature(path):
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return st.st_mtime_ns, st.st_size
+
+# ----------------------------
+# MODEL KINDS
+# ----------------------------
+def _load_yolo(path, sha1):
+    model = YOLO(path)
+    model(np.zeros((640, 640, 3), np.uint8), verbose=False)  # warm up
+    return model
+
+
+def _load_tessdata(path, sha1):
+    """Snapshot the traineddata into its own directory and check Tesseract loads it."""
+    target = os.path.join(_SNAPSHOT_DIR, sha1[:12])
+    if not os.path.exists(os.path.join(target, _TRAINEDDATA)):
+        os.makedirs(target, exist_ok=True)
+        tmp = os.path.join(target, _TRAINEDDATA + ".tmp")
+        shutil.copyfile(path, tmp)
+        os.replace(tmp, os.path.join(target, _TRAINEDDATA))
+    ocr._ocr_image(np.full((32, 96), 255, np.uint8), 7, target)  # raises if unusable
+    return target
+
+
+def _prune_snapshots(keep):
+    """Remove all but the newest snapshots, and never those in `keep`."""
+    if not os.path.isdir(_SNAPSHOT_DIR):
+        return
+    dirs = sorted((os.path.join(_SNAPSHOT_DIR, d) for d in os.listdir(_SNAPSHOT_DIR)),
+                  key=os.path.getmtime, reverse=True)
+    for d in dirs[_SNAPSHOTS_KEPT:]:
+        if d not in keep:
+            shutil.rmtree(d, ignore_errors=True)
+
+
+def _candidate_path(path):
+    """Resolve a shadow candidate's path; only files under the models directory are loaded."""
+    real = os.path.realpath(path)
+    if os.path.commonpath([real, _MODELS_DIR]) != _MODELS_DIR or not os.path.isfile(real):
+        raise ValueError(f"Candidate must be a file under {_MODELS_DIR}")
+    return real
+
+
+def _iou(a, b):
+    ix = max(0, min(a[2], b[2]) - max(a[0], b[0]))
+    iy = max(0, min(a[3], b[3]) - max(a[1], b[1]))
+    inter = ix * iy
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - inter
+    return inter / union if union else 0.0
+
+
+def _plate_output(img, model):
+    return detect.detect_plate(img, model=model)[1]
+
+
+def _plates_agree(a, b):
+    return a is None and b is None or a is not None and b is not None and _iou(a, b) >= 0.5
+
+
+def _vehicle_output(img, model):
+    return classify.detect_vehicle(img, model=model)
+
+
+def _text_output(crop, tessdata_dir):
+    if crop is None or crop.size == 0:
+        return None
+    best = ocr.ocr_plate(crop, tessdata_dir=tessdata_dir)
+    return best[0] if best else None
+
+
+class _Kind:
+    """How one model is loaded, installed and compared."""
+
+    def __init__(self, path, load, install, live, run, agree, takes="image", copy_live=False):
+        self.path = path
+        self.load = load          # (path, sha1) -> model
+        self.install = install    # model -> None, makes it live
+        self.live = live          # () -> live model
+        self.run = run            # (input, model) -> comparable output
+        self.agree = agree        # (output, output) -> bool
+        self.takes = takes        # input: decoded "image" or plate "crop"
+        self.copy_live = copy_live  # shadow runs need their own copy of the live model
+
+
+def _set(module, name):
+    return lambda model: setattr(module, name, model)
+
+
+KINDS = {
+    "plate": _Kind(detect._MODEL_PATH, _load_yolo, _set(detect, "_YOLO_MODEL"),
+                   lambda: detect._YOLO_MODEL, _plate_output, _plates_agree, copy_live=True),
+    "vehicle": _Kind(classify._CLASSIFY_MODEL_PATH, _load_yolo, _set(classify, "_model"),
+                     lambda: classify._model, _vehicle_output, lambda a, b: a == b,
+                     copy_live=True),
+    "tessdata": _Kind(os.path.join(ocr._TESSDATA_DIR, _TRAINEDDATA), _load_tessdata,
+                      _set(ocr, "_tessdata_dir"), lambda: ocr._tessdata_dir,
+                      _text_output, lambda a, b: a == b, takes="crop"),
+}
+
+# ----------------------------
+# SHADOW STATS
+# ----------------------------
+class _Shadow:
+    def __init__(self, name, path, model, sample):
+        self.name, self.kind = name, KINDS[name]
+        self.path, self.model, self.sample = path, model, sample
+        self.runs = self.agreed = self.errors = self.dropped = 0
+        self.live_ms = deque(maxlen=1000)
+        self.candidate_ms = deque(maxlen=1000)
+
+    def report(self):
+        def summary(ms):
+            if not ms:
+                return None
+            return {"mean": round(float(np.mean(ms)), 2),
+                    "p95": round(float(np.percentile(ms, 95)), 2)}
+        return {
+            "path": self.path, "sample": self.sample, "runs": self.runs,
+            "agreement": round(self.agreed / self.runs, 4) if self.runs else None,
+            "errors": self.errors, "dropped": self.dropped,
+            "live_ms": summary(self.live_ms), "candidate_ms": summary(self.candidate_ms),
+        }
+
+# ----------------------------
+# REGISTRY
+# ----------------------------
+class ModelRegistry:
+    """Watches model files, swaps in new versions and runs shadow comparisons."""
+
+    def __init__(self):
+        self._lock = threading.Lock()  # one load at a time
+        self._state = {name: {"path": kind.path, "version": None, "loaded_at": None,
+                              "error": None, "signature": None, "pending": None}
+                       for name, kind in KINDS.items()}
+        self._shadows = {}
+        self._shadow_live = {}  # name -> (version, model): the shadow thread's live copies
+        self._shadow_pool = ThreadPoolExecutor(1, thread_name_prefix="anpr-shadow")
+        self._shadow_backlog = threading.Semaphore(_SHADOW_BACKLOG)
+        self._stop = threading.Event()
+        self._watcher = None
+
+    def start(self, watch_interval=5.0):
+        """Record the models loaded at import, and watch their files if `watch_interval`."""
+        for name, kind in KINDS.items():
+            state = self._state[name]
+            state["signature"] = _signature(kind.path)
+            if state["signature"] is None:
+                continue
+            if name == "tessdata":
+                self.reload(name)  # move live OCR onto a snapshot
+            else:
+                state["version"], state["loaded_at"] = _sha1(kind.path), time.time()
+        if watch_interval:
+            self._watcher = threading.Thread(target=self._watch, args=(watch_interval,),
+                                             name="anpr-model-watch", daemon=True)
+            self._watcher.start()
+
+    def close(self):
+        self._stop.set()
+        self._shadow_pool.shutdown(wait=False, cancel_futures=True)
+
+    def _watch(self, interval):
+        while not self._stop.wait(interval):
+            for name in KINDS:
+                try:
+                    self.check(name)
+                except Exception as e:
+                    self._state[name]["error"] = str(e)
+
+    def check(self, name):
+        """Reload `name` if its file changed and has been stable for one check."""
+        state = self._state[name]
+        sig = _signature(KINDS[name].path)
+        if sig is None or sig == state["signature"]:
+            state["pending"] = None
+            return False
+        if sig != state["pending"]:
+            state["pending"] = sig  # still being written, perhaps; look again next time
+            return False
+        state["pending"] = None
+        self.reload(name)
+        return True
+
+    def reload(self, name):
+        """
+        Load and warm the current file of model `name`, then make it live.
+        Returns the model's status; on failure the old model stays live.
+        """
+        kind, state = KINDS[name], self._state[name]
+        with self._lock:
+            sig = _signature(kind.path)
+            try:
+                sha1 = _sha1(kind.path)
+                if sha1 != state["version"]:
+                    model = kind.load(kind.path, sha1)
+                    kind.install(model)  # atomic: a single global rebind
+                    state["version"], state["loaded_at"] = sha1, time.time()
+                    if name == "tessdata":
+                        self._prune(model)
+                state["error"] = None
+            except Exception as e:
+                state["error"] = f"{type(e).__name__}: {e}"
+            state["signature"] = sig
+        return self.status(name)
+
+    def _prune(self, live):
+        shadow = self._shadows.get("tessdata")
+        _prune_snapshots(keep={live} | ({shadow.model} if shadow else set()))
+
+    def status(self, name=None):
+        if name is None:
+            return {n: self.status(n) for n in KINDS}
+        state = self._state[name]
+        out = {k: state[k] for k in ("path", "version", "loaded_at", "error")}
+        shadow = self._shadows.get(name)
+        out["shadow"] = shadow.report() if shadow else None
+        return out
+
+    # ----------------------------
+    # SHADOW MODE
+    # ----------------------------
+    def start_shadow(self, name, path, sample=0.1):
+        """
+        Load the candidate at `path` (a file under the models directory) and
+        compare it with model `name` on `sample` of traffic.
+        """
+        kind = KINDS[name]
+        path = _candidate_path(path)
+        model = kind.load(path, _sha1(path))
+        self._shadows[name] = _Shadow(name, path, model, sample)
+        return self.status(name)
+
+    def stop_shadow(self, name):
+        shadow = self._shadows.pop(name, None)
+        if not self._shadows:
+            self._shadow_live.clear()
+        return shadow.report() if shadow else None
+
+    def observe(self, image_input):
+        """Offer a served request to the shadow runs; never blocks the caller."""
+        sampled = [s for s in list(self._shadows.values()) if random.random() < s.sample]
+        if not sampled:
+            return
+        if not self._shadow_backlog.acquire(blocking=False):
+            for s in sampled:
+                s.dropped += 1
+            return
+        future = self._shadow_pool.submit(self._compare, image_input, sampled)
+        future.add_done_callback(lambda _: self._shadow_backlog.release())
+
+    def _live_copy(self, name):
+        """
+        Live model `name` for a shadow comparison. YOLO models get a private
+        copy, reloaded when the live version changes, since running the live
+        object would hold up the requests waiting on its lock.
+        """
+        kind = KINDS[name]
+        if not kind.copy_live:
+            return kind.live()
+        version = self._state[name]["version"]
+        copy = self._shadow_live.get(name)
+        if copy is None or copy[0] != version:
+            copy = self._shadow_live[name] = (version, kind.load(kind.path, version))
+        return copy[1]
+
+    def _compare(self, image_input, shadows):
+        inputs = {"image": detect.load_image(image_input)}
+        if inputs["image"] is None:
+            return
+        if any(s.kind.takes == "crop" for s in shadows):
+            inputs["crop"] = detect.detect_plate(inputs["image"], model=self._live_copy("plate"))[0]
+        for s in shadows:
+            arg = inputs[s.kind.takes]
+            try:
+                live_model = self._live_copy(s.name)
+                t = time.perf_counter()
+                live = s.kind.run(arg, live_model)
+                t_live = time.perf_counter()
+                candidate = s.kind.run(arg, s.model)
+                t_candidate = time.perf_counter()
+            except Exception:
+                s.errors += 1
+                continue
+            s.runs += 1
+            s.agreed += bool(s.kind.agree(live, candidate))
+            s.live_ms.append((t_live - t) * 1000)
+            s.candidate_ms.append((t_candidate - t_live) * 1000)
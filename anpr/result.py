@@ -0,0 +1,43 @@
+from dataclasses import asdict, dataclass, field
+from enum import Enum
+
+
+class FailureReason(str, Enum):
+    """Why a recognition attempt produced no plate."""
+    DECODE_FAILED = "decode_failed"      # input is not a readable image
+    NO_PLATE = "no_plate"                # detector found no plate
+    DETECT_ERROR = "detect_error"        # detector raised
+    NO_TEXT = "no_text"                  # OCR read nothing on the plate
+    INVALID_FORMAT = "invalid_format"    # OCR text doesn't match PLATE_REGEX
+    OCR_ERROR = "ocr_error"              # OCR raised
+
+
+@dataclass(slots=True)
+class PlateResult:
+    """
+    Outcome of one recognition: the plate text (None on failure), where it
+    was found, how confident each stage was, which OCR variant/psm won, why
+    it failed if it did, and how long each stage took (seconds). `roi` is the
+    camera region the plate was detected in, or None for the full frame.
+    """
+    text: str | None = None
+    bbox: tuple[int, int, int, int] | None = None
+    det_conf: float | None = None
+    ocr_conf: float | None = None
+    variant: str | None = None
+    psm: int | None = None
+    failure: FailureReason | None = None
+    error: str | None = None
+    timings: dict[str, float] = field(default_factory=dict)
+    roi: tuple[int, int, int, int] | None = None
+
+    @property
+    def ok(self) -> bool:
+        return self.failure is None
+
+    def to_dict(self) -> dict:
+        d = asdict(self)
+        d["failure"] = self.failure.value if self.failure else None
+        d["bbox"] = list(self.bbox) if self.bbox else None
+        d["roi"] = list(self.roi) if self.roi else None
+        return d
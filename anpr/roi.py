@@ -0,0 +1,138 @@
+"""
+Per-camera regions of interest for plate detection.
+
+Fixed gate cameras see plates in the same band of the frame every time, so
+detection can run on that band only: a smaller input is faster, and because
+YOLO resizes its input to a fixed size, small distant plates get more pixels.
+A camera's ROI is either declared in a JSON file or learned from the plates
+it detected recently. When the ROI yields nothing, detection falls back to
+the full frame, and plates found there widen the learned ROI.
+
+cameras.json (ROI as fractions of the frame: x1, y1, x2, y2):
+    {"gate-1": {"roi": [0.2, 0.45, 0.8, 0.95]},
+     "gate-2": {"roi": [0, 0.5, 1, 1], "fallback": false}}
+"""
+
+import json
+import os
+import threading
+from collections import OrderedDict, deque
+
+import numpy as np
+
+LEARN_FROM = 20      # detections needed before a learned ROI is used
+LEARN_WINDOW = 200   # most recent detections the learned ROI covers
+MAX_LEARNED = 256    # undeclared cameras tracked; the least recently used is forgotten
+
+
+class CameraProfile:
+    """ROI of one camera, declared or learned; safe to share between threads."""
+
+    def __init__(self, roi=None, fallback=True):
+        self.declared = tuple(roi) if roi else None
+        self.fallback = fallback
+        self._boxes = deque(maxlen=LEARN_WINDOW)  # recent plates, as frame fractions
+        self._lock = threading.Lock()
+        self.hits = self.misses = 0
+
+    def roi(self, shape):
+        """Pixel ROI (x1, y1, x2, y2) for a frame of `shape`, or None for the full frame."""
+        frac = self.declared or self._learned()
+        if frac is None:
+            return None
+        h, w = shape[:2]
+        x1, y1, x2, y2 = (int(round(v * s)) for v, s in zip(frac, (w, h, w, h)))
+        if x2 - x1 < 32 or y2 - y1 < 32:
+            return None
+        return x1, y1, x2, y2
+
+    def _learned(self):
+        with self._lock:
+            if len(self._boxes) < LEARN_FROM:
+                return None
+            boxes = np.array(self._boxes)
+        # Bounds of recent plates, padded by a plate's size so nearby ones still fit
+        pad_x = np.median(boxes[:, 2] - boxes[:, 0]) * 0.5
+        pad_y = np.median(boxes[:, 3] - boxes[:, 1])
+        return (max(0.0, boxes[:, 0].min() - pad_x), max(0.0, boxes[:, 1].min() - pad_y),
+                min(1.0, boxes[:, 2].max() + pad_x), min(1.0, boxes[:, 3].max() + pad_y))
+
+    def detect(self, img, detect_fn):
+        """
+        Run `detect_fn(image) -> (crop, bbox, conf)` on the ROI, and on the full frame
+        if that found nothing (unless fallback is off). The bbox is in frame pixels.
+        Returns (crop, bbox, conf, roi), roi being the region the plate was found in
+        or None for the full frame.
+        """
+        roi = self.roi(img.shape)
+        if roi is not None:
+            x1, y1, x2, y2 = roi
+            crop, bbox, conf = detect_fn(img[y1:y2, x1:x2])
+            if bbox is not None:
+                bbox = (bbox[0] + x1, bbox[1] + y1, bbox[2] + x1, bbox[3] + y1)
+                self._record(bbox, img.shape, hit=True)
+                return crop, bbox, conf, roi
+            self._record(None, img.shape, hit=False)
+            if not self.fallback:
+                return None, None, None, roi
+        crop, bbox, conf = detect_fn(img)
+        if bbox is not None:
+            self._record(bbox, img.shape)
+        return crop, bbox, conf, None
+
+    def _record(self, bbox, shape, hit=None):
+        with self._lock:
+            if hit is True:
+                self.hits += 1
+            elif hit is False:
+                self.misses += 1
+            if bbox is not None:
+                h, w = shape[:2]
+                self._boxes.append((bbox[0] / w, bbox[1] / h, bbox[2] / w, bbox[3] / h))
+
+    def status(self):
+        frac = self.declared or self._learned()
+        return {"roi": [round(float(v), 4) for v in frac] if frac else None,
+                "declared": self.declared is not None, "fallback": self.fallback,
+                "samples": len(self._boxes), "hits": self.hits, "misses": self.misses}
+
+
+class CameraProfiles:
+    """
+    Profiles by camera id: declared ones from a JSON file, others learned on
+    first use. Camera ids come from clients, so at most `max_learned` learned
+    profiles are kept, evicting the least recently used.
+    """
+
+    def __init__(self, declared=None, max_learned=MAX_LEARNED):
+        self._declared = {cid: CameraProfile(**cfg) for cid, cfg in (declared or {}).items()}
+        self._learned = OrderedDict()
+        self.max_learned = max_learned
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls, path, max_learned=MAX_LEARNED):
+        """Profiles declared in `path`, if it exists."""
+        if not path or not os.path.exists(path):
+            return cls(max_learned=max_learned)
+        with open(path, "r") as f:
+            return cls(json.load(f), max_learned)
+
+    def get(self, camera_id):
+        with self._lock:
+            profile = self._declared.get(camera_id)
+            if profile is not None:
+                return profile
+            profile = self._learned.get(camera_id)
+            if profile is None:
+                profile = self._learned[camera_id] = CameraProfile()
+                if len(self._learned) > self.max_learned:
+                    self._learned.popitem(last=False)
+            else:
+                self._learned.move_to_end(camera_id)
+            return profile
+
+    def status(self):
+        with self._lock:
+            profiles = {**self._declared, **self._learned}
+        return {cid: p.status() for cid, p in profiles.items()}
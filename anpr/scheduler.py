@@ -0,0 +1,93 @@
+"""
+Priority scheduling with load-adaptive quality for the API server.
+
+Work is queued by priority (live traffic before bulk/archive work) and run on
+a fixed number of worker threads. When an item is picked up, the time it
+spent waiting picks a rung of the quality ladder: the longer the queue, the
+cheaper the recognition, so requests degrade instead of timing out.
+"""
+
+import asyncio
+import enum
+import itertools
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+class Priority(enum.IntEnum):
+    HIGH = 0
+    LOW = 1
+
+
+# Quality ladder, best first. "recognize" is passed to recognize_plate();
+# "tiled" allows tiled detection of high-resolution frames, if configured.
+QUALITY_LEVELS = [
+    {"recognize": {}, "tiled": True, "skip_vehicle": False},
+    {"recognize": {"variants": ("raw_gray",), "psms": (7,)}, "tiled": True, "skip_vehicle": False},
+    {"recognize": {"variants": ("raw_gray",), "psms": (7,), "imgsz": 480}, "tiled": False,
+     "skip_vehicle": False},
+    {"recognize": {"variants": ("raw_gray",), "psms": (7,), "imgsz": 480}, "tiled": False,
+     "skip_vehicle": True},
+]
+
+# Queue wait (seconds) at which each lower rung kicks in
+DEGRADE_AFTER = (0.15, 0.4, 0.8)
+
+# Lowest rung each priority may be pushed to; live traffic keeps vehicle typing
+MAX_LEVEL = {Priority.HIGH: 2, Priority.LOW: 3}
+
+
+def quality_level(wait, priority):
+    """Ladder rung for an item that queued for `wait` seconds."""
+    level = sum(wait >= t for t in DEGRADE_AFTER)
+    return min(level, MAX_LEVEL[priority])
+
+
+class Scheduler:
+    """
+    Runs `fn(level)` callables on worker threads, highest priority first
+    (FIFO within a priority). Must be started from a running event loop.
+    """
+
+    def __init__(self, workers=2):
+        self.workers = workers
+        self._queue = None
+        self._tasks = []
+        self._executor = ThreadPoolExecutor(workers, thread_name_prefix="anpr")
+        self._order = itertools.count()
+
+    def start(self):
+        self._queue = asyncio.PriorityQueue()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def depth(self):
+        """Items waiting for a worker."""
+        return self._queue.qsize()
+
+    async def submit(self, fn, priority=Priority.HIGH):
+        """Queue `fn(level)`; returns (its result, the quality level used)."""
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((int(priority), next(self._order), time.monotonic(), fn, future))
+        return await future
+
+    async def _worker(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            priority, _, queued_at, fn, future = await self._queue.get()
+            if future.cancelled():
+                continue  # the client went away while it waited
+            level = quality_level(time.monotonic() - queued_at, Priority(priority))
+            try:
+                result = await loop.run_in_executor(self._executor, fn, level)
+            except Exception as e:
+                if not future.cancelled():
+                    future.set_exception(e)
+            else:
+                if not future.cancelled():
+                    future.set_result((result, level))
@@ -0,0 +1,113 @@
+"""
+Shared-memory frame transport for inference worker processes.
+
+A FrameRing is one `multiprocessing.shared_memory` block cut into fixed-size
+frame slots. The owning process decodes each frame into a free slot
+and hands workers a small FrameRef (ring name, slot, shape, dtype) instead of
+pickling the pixels; workers map the same memory and read the frame in
+place. Plate crops are views into the frame, so they travel as a FrameRef
+plus a bbox. A slot stays taken until the owner releases it, and `put()`
+blocks (or raises RingFull after `timeout`) while every slot is in use, which
+bounds the number of frames in flight.
+
+Usage:
+    ring = FrameRing(slots=8, slot_bytes=FrameRing.bytes_for(3000, 4000))
+    ref = ring.put(img)
+    future = pool.submit(worker, ref)       # worker: frame = open_frame(ref)
+    ...
+    ring.release(ref)
+"""
+
+import threading
+from collections import namedtuple
+from multiprocessing import shared_memory
+
+import cv2
+import numpy as np
+
+FrameRef = namedtuple("FrameRef", ["ring", "slot", "offset", "shape", "dtype"])
+
+
+class RingFull(Exception):
+    """No slot was freed within the timeout."""
+
+
+class FrameRing:
+    """Preallocated frame slots in shared memory, owned by one process."""
+
+    def __init__(self, slots=8, slot_bytes=1920 * 1080 * 3):
+        self.slots = slots
+        self.slot_bytes = slot_bytes
+        self._shm = shared_memory.SharedMemory(create=True, size=slots * slot_bytes)
+        self.name = self._shm.name
+        self._free = list(range(slots))
+        self._cond = threading.Condition()
+
+    @staticmethod
+    def bytes_for(height, width, channels=3, dtype=np.uint8):
+        """Slot size needed for frames of this shape."""
+        return height * width * channels * np.dtype(dtype).itemsize
+
+    def put(self, img, timeout=None):
+        """Copy `img` into a free slot and return its FrameRef."""
+        if img.nbytes > self.slot_bytes:
+            raise ValueError(f"frame of {img.nbytes} bytes does not fit a {self.slot_bytes} byte slot")
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._free, timeout):
+                raise RingFull(f"all {self.slots} frame slots are in use")
+            slot = self._free.pop()
+        ref = FrameRef(self.name, slot, slot * self.slot_bytes, img.shape, img.dtype.str)
+        np.copyto(self.view(ref), img, casting="no")
+        return ref
+
+    def decode(self, data, timeout=None):
+        """Decode encoded image bytes into a free slot; None if they are not an image."""
+        # OpenCV cannot decode into a caller's buffer, so this is one frame copy
+        img = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+        return None if img is None else self.put(img, timeout)
+
+    def view(self, ref):
+        """The frame in `ref` as an ndarray backed by the ring (no copy)."""
+        return np.ndarray(ref.shape, ref.dtype, self._shm.buf, ref.offset)
+
+    def release(self, ref):
+        """Give the slot back once every worker is done with the frame."""
+        with self._cond:
+            self._free.append(ref.slot)
+            self._cond.notify()
+
+    def in_use(self):
+        return self.slots - len(self._free)
+
+    def close(self):
+        """Free the shared memory; views into it must no longer be used."""
+        self._shm.close()
+        self._shm.unlink()
+
+
+# Worker side: rings attached by this process, by name
+_attached = {}
+
+
+def _attach(name):
+    shm = _attached.get(name)
+    if shm is None:
+        try:
+            # Workers must not unlink the owner's memory when they exit
+            shm = shared_memory.SharedMemory(name=name, track=False)
+        except TypeError:  # Python < 3.13
+            shm = shared_memory.SharedMemory(name=name)
+        _attached[name] = shm
+    return shm
+
+
+def open_frame(ref, bbox=None):
+    """
+    Worker-side view of a frame, or of the `bbox` (x1, y1, x2, y2) crop in it.
+    Valid until the owner releases the slot; copy anything kept longer.
+    """
+    frame = np.ndarray(ref.shape, ref.dtype, _attach(ref.ring).buf, ref.offset)
+    if bbox is None:
+        return frame
+    x1, y1, x2, y2 = bbox
+    return frame[y1:y2, x1:x2]
@@ -0,0 +1,185 @@
+"""
+Plate sightings store: every read, queryable by plate, camera and time.
+
+Sightings are appended to a local SQLite database in WAL mode by a
+background thread that writes them in batches, so recording one is a
+non-blocking queue put on the request path (when the queue is full the
+sighting is dropped and counted rather than making the request wait).
+Plates are stored normalized and folded over OCR confusion classes
+(see anpr.watchlist), each indexed with the timestamp, so exact, prefix
+and confusion-tolerant lookups over a time range are index range scans.
+
+    store = SightingStore("sightings.sqlite")
+    store.record("MH12AB1234", camera="gate-1")
+    store.query("MH12A81234", match="fuzzy", since=time.time() - 86400)
+"""
+
+import queue
+import sqlite3
+import sys
+import threading
+import time
+
+from .utils import normalize_plate
+from .watchlist import fold_plate, weighted_distance
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS sightings (
+    id       INTEGER PRIMARY KEY,
+    ts       REAL NOT NULL,          -- unix time
+    camera   TEXT,
+    plate    TEXT NOT NULL,          -- normalize_plate() output
+    folded   TEXT NOT NULL,          -- plate folded over confusable characters
+    det_conf REAL,
+    ocr_conf REAL
+);
+CREATE INDEX IF NOT EXISTS sightings_plate ON sightings(plate, ts);
+CREATE INDEX IF NOT EXISTS sightings_folded ON sightings(folded, ts);
+CREATE INDEX IF NOT EXISTS sightings_camera ON sightings(camera, ts);
+CREATE INDEX IF NOT EXISTS sightings_ts ON sightings(ts);
+"""
+
+MATCHES = ("exact", "prefix", "fuzzy")
+
+
+def _connect(path):
+    conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+
+class SightingStore:
+    """Append-only sightings database with a batching background writer."""
+
+    def __init__(self, path, batch_size=1000, flush_interval=0.5, max_pending=100_000):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.written = self.dropped = self.failed = 0
+        self.last_error = None
+        self._pending = queue.Queue(max_pending)
+        self._conn = _connect(path)
+        self._conn.executescript(_SCHEMA)
+        self._readers = threading.local()
+        self._writer = threading.Thread(target=self._write_loop, name="anpr-sightings",
+                                        daemon=True)
+        self._writer.start()
+
+    def record(self, plate, camera=None, ts=None, det_conf=None, ocr_conf=None):
+        """Queue a sighting; never blocks. Returns False if it was dropped."""
+        plate = normalize_plate(plate.upper())
+        if not plate:
+            return False
+        row = (time.time() if ts is None else ts, camera, plate, fold_plate(plate),
+               det_conf, ocr_conf)
+        try:
+            self._pending.put_nowait(row)
+        except queue.Full:
+            self.dropped += 1
+            return False
+        return True
+
+    def _write_loop(self):
+        stop = False
+        while not stop:
+            rows = [self._pending.get()]
+            deadline = time.monotonic() + self.flush_interval
+            while len(rows) < self.batch_size:
+                try:
+                    rows.append(self._pending.get(timeout=max(0.0, deadline - time.monotonic())))
+                except queue.Empty:
+                    break
+            taken = len(rows)
+            if rows[-1] is None:  # close()
+                rows.pop()
+                stop = True
+            if rows:
+                try:
+                    self._write(rows)
+                except Exception as e:
+                    # Lose this batch, not the writer: later sightings still get written
+                    if self._conn.in_transaction:
+                        self._conn.execute("ROLLBACK")
+                    self.failed += len(rows)
+                    self.last_error = f"{type(e).__name__}: {e}"
+                    print(f"Sightings: could not write {len(rows)} rows: {e}", file=sys.stderr)
+            for _ in range(taken):
+                self._pending.task_done()
+
+    def _write(self, rows):
+        self._conn.execute("BEGIN")
+        self._conn.executemany(
+            "INSERT INTO sightings (ts, camera, plate, folded, det_conf, ocr_conf) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            rows,
+        )
+        self._conn.execute("COMMIT")
+        self.written += len(rows)
+
+    def flush(self):
+        """Wait until everything recorded so far is written."""
+        self._pending.join()
+
+    def close(self):
+        """Write what is pending, then stop the writer."""
+        self._pending.put(None)
+        self._writer.join()
+        self._conn.close()
+
+    def _reader(self):
+        conn = getattr(self._readers, "conn", None)
+        if conn is None:
+            conn = self._readers.conn = _connect(self.path)
+            conn.create_function("plate_cost", 2, weighted_distance, deterministic=True)
+        return conn
+
+    def query(self, plate=None, match="exact", camera=None, since=None, until=None,
+              limit=100, max_cost=1.0):
+        """
+        Sightings, newest first, as dicts {"ts", "camera", "plate", "det_conf",
+        "ocr_conf"}, plus "cost" (edit cost from `plate`) for fuzzy matches.
+        match="exact": the plate itself; "prefix": plates starting with it;
+        "fuzzy": plates equal to it up to confusable characters (0/O, 8/B, ...),
+        within `max_cost`.
+        """
+        if match not in MATCHES:
+            raise ValueError(f"match must be one of {', '.join(MATCHES)}")
+        where, args = [], []
+        if plate is not None:
+            plate = normalize_plate(plate.upper())
+            if match == "exact":
+                where.append("plate = ?")
+                args.append(plate)
+            elif match == "prefix":
+                # A range instead of LIKE, so the index is used
+                where.append("plate >= ? AND plate < ?")
+                args += [plate, plate + "\U0010ffff"]
+            else:
+                # Filtered in SQL, so LIMIT counts only the matches
+                where.append("folded = ? AND plate_cost(?, plate) <= ?")
+                args += [fold_plate(plate), plate, max_cost]
+        if camera is not None:
+            where.append("camera = ?")
+            args.append(camera)
+        if since is not None:
+            where.append("ts >= ?")
+            args.append(since)
+        if until is not None:
+            where.append("ts < ?")
+            args.append(until)
+
+        columns = "ts, camera, plate, det_conf, ocr_conf"
+        if plate is not None and match == "fuzzy":
+            columns += ", plate_cost(?, plate) AS cost"
+            args.insert(0, plate)
+        sql = f"SELECT {columns} FROM sightings"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY ts DESC LIMIT ?"
+        return [dict(r) for r in self._reader().execute(sql, args + [limit])]
+
+    def stats(self):
+        return {"written": self.written, "pending": self._pending.qsize(),
+                "dropped": self.dropped, "failed": self.failed, "last_error": self.last_error}
@@ -0,0 +1,229 @@
+"""
+Watchlist matching: fuzzy lookup of plates in lists of millions of entries.
+
+A list is built once into an index directory of .npy arrays that are opened
+memory-mapped, so every worker process shares one copy through the page
+cache and opening is instant. Lookup is a symmetric-deletion search:
+
+  - plates are first folded over OCR confusion classes (0/O/D/Q, 8/B, ...),
+    so confusable substitutions cost nothing to find;
+  - the index holds a hash of each folded plate and of each folded plate
+    with one character deleted, in sorted arrays searched by bisection;
+  - a read is looked up with the same variants, which finds every entry
+    within one insertion, deletion or substitution of it after folding.
+    Reads with two errors are found when at least one is a confusable
+    substitution, the usual OCR failure.
+
+Candidates are then scored with an edit distance where confusable
+substitutions are cheap, and those within `max_cost` are returned.
+
+Build an index, then match:
+    python -m anpr.watchlist build stolen.txt -o stolen.idx
+    wl = Watchlist.open("stolen.idx")
+    wl.match("MH12AB1234")   # -> [Match(plate='MH12A81234', cost=0.25)]
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from collections import namedtuple
+
+import numpy as np
+
+from .utils import normalize_plate
+
+WIDTH = 12  # longest plate stored, in characters
+
+# Characters OCR confuses on plates; substituting within a group is cheap
+CONFUSABLE = ("0ODQ", "1IL", "2Z", "5S", "6G", "8B", "7T", "4A")
+CONFUSABLE_COST = 0.25
+
+_FOLD = bytearray(range(256))
+for _group in CONFUSABLE:
+    for _c in _group:
+        _FOLD[ord(_c)] = ord(_group[0])
+_FOLD = bytes(_FOLD)
+_FOLD_NP = np.frombuffer(_FOLD, np.uint8)
+_GROUP = {c: i for i, group in enumerate(CONFUSABLE) for c in group}
+
+_FNV_OFFSET = 0xCBF29CE484222325
+_FNV_PRIME = 0x100000001B3
+_MASK = (1 << 64) - 1
+
+Match = namedtuple("Match", ["plate", "cost"])
+
+_ARRAYS = ("plates", "exact_keys", "exact_ids", "del_keys", "del_ids")
+
+
+def fold_plate(plate):
+    """`plate` with each confusable character replaced by the first of its group."""
+    return plate.encode().translate(_FOLD).decode()
+
+
+def _hash(s):
+    """64-bit FNV-1a of a folded plate (bytes)."""
+    h = _FNV_OFFSET
+    for c in s:
+        h = ((h ^ c) * _FNV_PRIME) & _MASK
+    return h
+
+
+def _hash_rows(rows, lengths):
+    """_hash of each row of a zero-padded uint8 array, over its first `lengths` bytes."""
+    h = np.full(len(rows), _FNV_OFFSET, np.uint64)
+    prime = np.uint64(_FNV_PRIME)
+    for j in range(rows.shape[1]):
+        active = j < lengths
+        h = np.where(active, (h ^ rows[:, j].astype(np.uint64)) * prime, h)
+    return h
+
+
+def _del_key(h):
+    """Deletion variants are stored as 32-bit hashes to halve the biggest array."""
+    return h >> 32
+
+
+def weighted_distance(a, b, max_cost=None):
+    """Edit distance with cheap substitutions between confusable characters."""
+    if max_cost is not None and abs(len(a) - len(b)) > max_cost:
+        return float("inf")
+    prev = [float(j) for j in range(len(b) + 1)]
+    for i, ca in enumerate(a, 1):
+        cur = [float(i)]
+        ga = _GROUP.get(ca)
+        for j, cb in enumerate(b, 1):
+            if ca == cb:
+                sub = 0.0
+            elif ga is not None and ga == _GROUP.get(cb):
+                sub = CONFUSABLE_COST
+            else:
+                sub = 1.0
+            cur.append(min(prev[j] + 1, cur[j - 1] + 1, prev[j - 1] + sub))
+        prev = cur
+    return prev[-1]
+
+
+def build(plates, path):
+    """
+    Build an index of `plates` (an iterable of strings) in directory `path`.
+    Entries are normalized and deduplicated; returns the number indexed.
+    """
+    clean = {normalize_plate(p.upper()) for p in plates}
+    clean = sorted(p for p in clean if 0 < len(p) <= WIDTH)
+    stored = np.array(clean, dtype=f"S{WIDTH}")
+
+    rows = np.zeros((len(stored), WIDTH), np.uint8)
+    if len(stored):
+        rows[:] = stored.view(np.uint8).reshape(len(stored), WIDTH)
+    rows = _FOLD_NP[rows]
+    lengths = np.char.str_len(stored) if len(stored) else np.zeros(0, np.int64)
+    ids = np.arange(len(stored), dtype=np.uint32)
+
+    exact = _hash_rows(rows, lengths)
+    order = np.argsort(exact, kind="stable")
+    arrays = {"plates": stored, "exact_keys": exact[order], "exact_ids": ids[order]}
+
+    del_keys, del_ids = [], []
+    pad = np.zeros((len(rows), 1), np.uint8)
+    for i in range(WIDTH):
+        has = i < lengths
+        deleted = np.concatenate([rows[has, :i], rows[has, i + 1:], pad[has]], axis=1)
+        del_keys.append(_del_key(_hash_rows(deleted, lengths[has] - 1)).astype(np.uint32))
+        del_ids.append(ids[has])
+    del_keys, del_ids = np.concatenate(del_keys), np.concatenate(del_ids)
+    order = np.argsort(del_keys, kind="stable")
+    arrays.update(del_keys=del_keys[order], del_ids=del_ids[order])
+
+    os.makedirs(path, exist_ok=True)
+    for name, arr in arrays.items():
+        np.save(os.path.join(path, name + ".npy"), arr)
+    with open(os.path.join(path, "meta.json"), "w") as f:
+        json.dump({"entries": len(stored), "width": WIDTH, "confusable": CONFUSABLE}, f)
+    return len(stored)
+
+
+class Watchlist:
+    """A memory-mapped watchlist index; safe to share between threads."""
+
+    def __init__(self, arrays):
+        for name in _ARRAYS:
+            setattr(self, "_" + name, arrays[name])
+
+    @classmethod
+    def open(cls, path):
+        with open(os.path.join(path, "meta.json")) as f:
+            meta = json.load(f)
+        if meta["width"] != WIDTH or tuple(meta["confusable"]) != CONFUSABLE:
+            raise ValueError(f"{path} was built with different settings; rebuild it")
+        return cls({name: np.load(os.path.join(path, name + ".npy"), mmap_mode="r")
+                    for name in _ARRAYS})
+
+    def __len__(self):
+        return len(self._plates)
+
+    def __contains__(self, plate):
+        return any(m.cost == 0 for m in self.match(plate, max_cost=0))
+
+    def _lookup(self, keys, ids, probes):
+        lo = np.searchsorted(keys, probes, "left")
+        hi = np.searchsorted(keys, probes, "right")
+        found = set()
+        for a, b in zip(lo.tolist(), hi.tolist()):
+            if a != b:
+                found.update(ids[a:b].tolist())
+        return found
+
+    def match(self, plate, max_cost=1.0):
+        """Entries within `max_cost` of `plate`, as Match(plate, cost), best first."""
+        plate = normalize_plate(plate.upper())
+        if not plate or len(plate) > WIDTH + 1 or not len(self._plates):
+            return []
+        folded = fold_plate(plate).encode()
+        variants = [_hash(folded)] + [_hash(folded[:i] + folded[i + 1:]) for i in range(len(folded))]
+        probes = np.array(variants, np.uint64)
+
+        # Same plate or entry with one char dropped by OCR, then one char too
+        # many in the read or a substitution (deleted on both sides)
+        candidates = self._lookup(self._exact_keys, self._exact_ids, probes)
+        candidates |= self._lookup(self._del_keys, self._del_ids, _del_key(probes).astype(np.uint32))
+
+        hits = []
+        for i in candidates:
+            entry = self._plates[i].decode()
+            cost = weighted_distance(plate, entry, max_cost)
+            if cost <= max_cost:
+                hits.append(Match(entry, cost))
+        return sorted(hits, key=lambda m: (m.cost, m.plate))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m anpr.watchlist",
+                                     description="Build or query a watchlist index.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p = sub.add_parser("build", help="index a text file with one plate per line")
+    p.add_argument("source", help="plate list ('-' for stdin)")
+    p.add_argument("-o", "--output", required=True, help="index directory")
+    p = sub.add_parser("match", help="look plates up in an index")
+    p.add_argument("index")
+    p.add_argument("plates", nargs="+")
+    p.add_argument("--max-cost", type=float, default=1.0)
+    args = parser.parse_args(argv)
+
+    if args.command == "build":
+        t = time.perf_counter()
+        stream = sys.stdin if args.source == "-" else open(args.source, "r")
+        with stream:
+            n = build((line for line in stream if line.strip()), args.output)
+        print(f"Indexed {n} plates in {time.perf_counter() - t:.1f}s -> {args.output}",
+              file=sys.stderr)
+    else:
+        wl = Watchlist.open(args.index)
+        for plate in args.plates:
+            hits = wl.match(plate, args.max_cost)
+            print(plate, " ".join(f"{m.plate}({m.cost:g})" for m in hits) or "-")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""
+Frame handoff to worker processes: pickling vs the shared-memory FrameRing.
+
+Each frame is sent to a process pool whose worker reads a plate-sized crop
+and returns a few bytes, so the numbers are dominated by the transport.
+
+Usage:
+    python -m benchmarks.bench_shm [--frames 200] [--workers 4]
+"""
+
+import argparse
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from anpr.shm import FrameRing, open_frame
+
+SIZES = {"1080p": (1080, 1920), "12MP": (3000, 4000)}
+BBOX = (400, 300, 700, 400)  # a plate-sized crop
+
+
+def _work(frame):
+    return int(frame[BBOX[1]:BBOX[3], BBOX[0]:BBOX[2]].sum())
+
+
+def _pickled(frame):
+    return _work(frame)
+
+
+def _shared(ref):
+    return _work(open_frame(ref))
+
+
+def _run(pool, submit, n, in_flight):
+    """Keep `in_flight` frames outstanding; returns (seconds, per-frame latencies)."""
+    latencies, pending = [], []
+    start = time.perf_counter()
+    for i in range(n):
+        if len(pending) >= in_flight:
+            finish, t0 = pending.pop(0)
+            finish()
+            latencies.append(time.perf_counter() - t0)
+        t0 = time.perf_counter()
+        pending.append((submit(i), t0))
+    for finish, t0 in pending:
+        finish()
+        latencies.append(time.perf_counter() - t0)
+    return time.perf_counter() - start, latencies
+
+
+def bench(name, shape, frames, workers):
+    h, w = shape
+    rng = np.random.default_rng(0)
+    imgs = [rng.integers(0, 256, (h, w, 3), np.uint8) for _ in range(4)]
+    in_flight = 2 * workers
+    rows = []
+
+    with ProcessPoolExecutor(workers) as pool:
+        pool.submit(_work, imgs[0][:1000, :1000]).result()  # start the workers
+
+        def pickled(i):
+            future = pool.submit(_pickled, imgs[i % len(imgs)])
+            return future.result
+
+        rows.append(("pickle", *_run(pool, pickled, frames, in_flight)))
+
+        ring = FrameRing(slots=in_flight, slot_bytes=FrameRing.bytes_for(h, w))
+        try:
+            def shared(i):
+                ref = ring.put(imgs[i % len(imgs)])
+                future = pool.submit(_shared, ref)
+
+                def finish():
+                    future.result()
+                    ring.release(ref)
+                return finish
+
+            rows.append(("shm ring", *_run(pool, shared, frames, in_flight)))
+        finally:
+            ring.close()
+
+    mb = h * w * 3 / 1e6
+    for transport, seconds, latencies in rows:
+        p50, p95 = np.percentile(np.array(latencies) * 1000, [50, 95])
+        print(f"{name:>6} ({mb:5.1f} MB)  {transport:<9} {frames / seconds:8.1f} frames/s"
+              f"   p50 {p50:7.2f} ms   p95 {p95:7.2f} ms")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--frames", type=int, default=200)
+    parser.add_argument("--workers", type=int, default=4)
+    args = parser.parse_args(argv)
+    for name, shape in SIZES.items():
+        bench(name, shape, args.frames, args.workers)
+
+
+if __name__ == "__main__":
+    main()
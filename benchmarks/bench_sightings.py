@@ -0,0 +1,99 @@
+"""
+Sightings store ingest rate and query latency on a synthetic history.
+
+Fills a store through SightingStore.record(), as the server does, with
+plates seen across cameras over --days, then times exact, prefix, fuzzy
+and camera + time-range queries. The default 100M rows need tens of GB
+of disk and a long fill; use --db to keep the store between runs (rows
+already there are kept and only the difference is added).
+
+Usage:
+    python -m benchmarks.bench_sightings [--rows 100000000] [--db sightings-bench.sqlite]
+"""
+
+import argparse
+import os
+import random
+import tempfile
+import time
+
+import numpy as np
+
+from anpr.sightings import SightingStore
+from benchmarks.bench_watchlist import misread, random_plates
+
+DAY = 86400
+
+
+def fill(store, n, plates, cameras, start, end, seed=0):
+    """Record `n` sightings of `plates`, spread uniformly over [start, end)."""
+    rnd = random.Random(seed)
+    t = time.perf_counter()
+    report = t
+    for i in range(n):
+        store.record(rnd.choice(plates), rnd.choice(cameras), ts=rnd.uniform(start, end))
+        while store._pending.full():  # keep up with the writer instead of dropping
+            time.sleep(0.001)
+        if time.perf_counter() - report >= 10:
+            report = time.perf_counter()
+            print(f"  {i:,} rows, {i / (report - t):,.0f} rows/s", flush=True)
+    store.flush()
+    return time.perf_counter() - t
+
+
+def timed(queries):
+    """Latency percentiles of calling each query, and the mean rows returned."""
+    times, rows = [], []
+    for fn in queries:
+        t = time.perf_counter()
+        rows.append(len(fn()))
+        times.append(time.perf_counter() - t)
+    ms = np.array(times) * 1000
+    return (f"p50 {np.percentile(ms, 50):7.2f} ms   p99 {np.percentile(ms, 99):7.2f} ms   "
+            f"{np.mean(rows):6.1f} rows")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=int, default=100_000_000)
+    parser.add_argument("--plates", type=int, default=5_000_000, help="distinct plates")
+    parser.add_argument("--cameras", type=int, default=200)
+    parser.add_argument("--days", type=float, default=90)
+    parser.add_argument("--queries", type=int, default=1000)
+    parser.add_argument("--db", help="store to fill and keep (default: a temporary file)")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = args.db or os.path.join(tmp, "sightings.sqlite")
+        store = SightingStore(path)
+        plates = list(random_plates(args.plates))
+        cameras = [f"cam-{i}" for i in range(args.cameras)]
+        end = time.time()
+        start = end - args.days * DAY
+
+        have = store._reader().execute("SELECT COUNT(*) FROM sightings").fetchone()[0]
+        if have < args.rows:
+            print(f"recording {args.rows - have:,} sightings ({have:,} already stored)")
+            elapsed = fill(store, args.rows - have, plates, cameras, start, end, seed=have)
+            print(f"ingest           {(args.rows - have) / elapsed:,.0f} rows/s "
+                  f"in {elapsed:.0f}s, dropped {store.dropped}")
+        size = sum(os.path.getsize(path + ext) for ext in ("", "-wal") if os.path.exists(path + ext))
+        print(f"store            {size / 1e9:.1f} GB ({size / max(args.rows, 1):.0f} B/row)")
+
+        rnd = random.Random(1)
+        sample = [rnd.choice(plates) for _ in range(args.queries)]
+        day_ago = end - DAY
+        print(f"exact, 24 h      {timed(lambda p=p: store.query(p, since=day_ago) for p in sample)}")
+        print(f"exact, all time  {timed(lambda p=p: store.query(p) for p in sample)}")
+        print(f"prefix (6 chars) {timed(lambda p=p: store.query(p[:6], 'prefix') for p in sample)}")
+        misreads = [misread(p, rnd) for p in sample]
+        print(f"fuzzy, misread   {timed(lambda p=p: store.query(p, 'fuzzy') for p in misreads)}")
+        print("camera, 1 h      " + timed(
+            lambda c=rnd.choice(cameras), t=rnd.uniform(start, end - 3600):
+                store.query(camera=c, since=t, until=t + 3600)
+            for _ in range(args.queries)))
+        store.close()
+
+
+if __name__ == "__main__":
+    main()
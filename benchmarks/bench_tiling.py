@@ -0,0 +1,109 @@
+"""
+Plate detection on high-resolution frames: single pass vs tiled.
+
+Each labelled image (YOLO label files, as in fine_tuning/dataset) is shrunk
+and pasted at a random spot of a 4K canvas to stand in for a distant plate on
+a highway camera; pass --native to use the images as they are instead, e.g.
+for real 4K frames. A frame counts as recalled when the top detection
+overlaps a labelled plate with IoU >= 0.5.
+
+Usage:
+    python -m benchmarks.bench_tiling [--images DIR --labels DIR] [--limit 200]
+        [--scale 0.25] [--imgsz 640 1920] [--tile 1280]
+"""
+
+import argparse
+import glob
+import os
+import random
+import time
+
+import cv2
+import numpy as np
+
+from anpr.detect import Tiling, detect_plate
+from fine_tuning.crop_plates import IMAGES_DIR, LABELS_DIR, yolo_to_bbox
+
+CANVAS = (2160, 3840)
+
+
+def _iou(a, b):
+    ix = max(0, min(a[2], b[2]) - max(a[0], b[0]))
+    iy = max(0, min(a[3], b[3]) - max(a[1], b[1]))
+    inter = ix * iy
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - inter
+    return inter / union if union else 0.0
+
+
+def load_frames(images_dir, labels_dir, limit, scale, native, seed=0):
+    """Yield (frame, [ground truth bbox, ...])."""
+    rnd = random.Random(seed)
+    paths = sorted(glob.glob(os.path.join(images_dir, "*.jpg")))[:limit]
+    for path in paths:
+        label = os.path.join(labels_dir, os.path.splitext(os.path.basename(path))[0] + ".txt")
+        img = cv2.imread(path)
+        if img is None or not os.path.exists(label):
+            continue
+        h, w = img.shape[:2]
+        with open(label) as f:
+            boxes = [yolo_to_bbox(line, w, h) for line in f if line.strip()]
+        if not boxes:
+            continue
+        if native:
+            yield img, boxes
+            continue
+
+        # Shrink to `scale` of the canvas width and paste it somewhere
+        s = CANVAS[1] * scale / w
+        small = cv2.resize(img, (max(1, int(w * s)), max(1, int(h * s))), interpolation=cv2.INTER_AREA)
+        sh, sw = small.shape[:2]
+        if sh > CANVAS[0]:
+            continue
+        x0, y0 = rnd.randrange(CANVAS[1] - sw + 1), rnd.randrange(CANVAS[0] - sh + 1)
+        frame = np.full((*CANVAS, 3), 90, np.uint8)
+        frame[y0:y0 + sh, x0:x0 + sw] = small
+        yield frame, [(int(x1 * s) + x0, int(y1 * s) + y0, int(x2 * s) + x0, int(y2 * s) + y0)
+                      for x1, y1, x2, y2 in boxes]
+
+
+def run(name, frames, detect):
+    hits, times = 0, []
+    for frame, truth in frames:
+        t = time.perf_counter()
+        _, bbox, _ = detect(frame)
+        times.append(time.perf_counter() - t)
+        hits += bbox is not None and any(_iou(bbox, gt) >= 0.5 for gt in truth)
+    ms = np.array(times) * 1000
+    print(f"{name:<22} recall {hits / len(frames):6.1%}   mean {ms.mean():7.1f} ms"
+          f"   p95 {np.percentile(ms, 95):7.1f} ms")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--images", default=IMAGES_DIR)
+    parser.add_argument("--labels", default=LABELS_DIR)
+    parser.add_argument("--limit", type=int, default=200)
+    parser.add_argument("--scale", type=float, default=0.25,
+                        help="pasted image width as a fraction of the 4K canvas")
+    parser.add_argument("--native", action="store_true", help="use the images unmodified")
+    parser.add_argument("--imgsz", type=int, nargs="+", default=[640, 1920],
+                        help="single-pass input sizes to compare")
+    parser.add_argument("--tile", type=int, nargs="+", default=[1280], help="tile sizes to compare")
+    args = parser.parse_args(argv)
+
+    frames = list(load_frames(args.images, args.labels, args.limit, args.scale, args.native))
+    if not frames:
+        parser.error("no labelled images found")
+    print(f"{len(frames)} frames of {frames[0][0].shape[1]}x{frames[0][0].shape[0]}")
+
+    detect_plate(frames[0][0])  # warm up
+    for imgsz in args.imgsz:
+        run(f"single imgsz={imgsz}", frames, lambda f, s=imgsz: detect_plate(f, imgsz=s))
+    for size in args.tile:
+        tiling = Tiling(size=size, min_pixels=0)
+        run(f"tiled {size}px x{len(tiling.tiles(frames[0][0].shape))}", frames,
+            lambda f, t=tiling: detect_plate(f, tiling=t))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""
+Watchlist build time, index size and match latency on a synthetic list.
+
+Usage:
+    python -m benchmarks.bench_watchlist [--entries 1000000] [--queries 5000]
+"""
+
+import argparse
+import os
+import random
+import string
+import tempfile
+import time
+
+import numpy as np
+
+from anpr.watchlist import Watchlist, build
+
+
+def random_plates(n, seed=0):
+    """Plates shaped like PLATE_REGEX: MH12AB1234."""
+    rnd = random.Random(seed)
+    letters, digits = string.ascii_uppercase, string.digits
+    for _ in range(n):
+        yield ("".join(rnd.choices(letters, k=2)) + "".join(rnd.choices(digits, k=2))
+               + "".join(rnd.choices(letters, k=rnd.randint(1, 2)))
+               + "".join(rnd.choices(digits, k=4)))
+
+
+def misread(plate, rnd):
+    """One random OCR error: substitution, insertion or deletion."""
+    i = rnd.randrange(len(plate))
+    op = rnd.choice("sid")
+    c = rnd.choice(string.ascii_uppercase + string.digits)
+    if op == "s":
+        return plate[:i] + c + plate[i + 1:]
+    if op == "i":
+        return plate[:i] + c + plate[i:]
+    return plate[:i] + plate[i + 1:]
+
+
+def timed(wl, queries):
+    times = []
+    for q in queries:
+        t = time.perf_counter()
+        wl.match(q)
+        times.append(time.perf_counter() - t)
+    us = np.array(times) * 1e6
+    return f"p50 {np.percentile(us, 50):7.1f} us   p99 {np.percentile(us, 99):7.1f} us"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--entries", type=int, default=1_000_000)
+    parser.add_argument("--queries", type=int, default=5000)
+    args = parser.parse_args(argv)
+
+    rnd = random.Random(1)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "list.idx")
+        t = time.perf_counter()
+        n = build(random_plates(args.entries), path)
+        size = sum(os.path.getsize(os.path.join(path, f)) for f in os.listdir(path))
+        print(f"built {n} entries in {time.perf_counter() - t:.1f}s, "
+              f"{size / 1e6:.0f} MB ({size / max(n, 1):.0f} B/entry)")
+
+        t = time.perf_counter()
+        wl = Watchlist.open(path)
+        print(f"opened in {(time.perf_counter() - t) * 1000:.1f} ms")
+
+        listed = [wl._plates[rnd.randrange(n)].decode() for _ in range(args.queries)]
+        wl.match(listed[0])  # fault in the first pages
+        print(f"listed plates    {timed(wl, listed)}")
+        misreads = [misread(p, rnd) for p in listed]
+        found = sum(any(m.plate == p for m in wl.match(q)) for p, q in zip(listed, misreads))
+        print(f"one-error reads  {timed(wl, misreads)}   found {found / len(listed):.1%}")
+        print(f"unlisted plates  {timed(wl, list(random_plates(args.queries, seed=2)))}")
+
+
+if __name__ == "__main__":
+    main()
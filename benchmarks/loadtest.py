@@ -0,0 +1,314 @@
+"""
+End-to-end load test of server.py.
+
+Replays images at an open-loop arrival rate: requests are sent on schedule
+whether or not earlier ones have finished (up to --concurrency in flight),
+and latency is measured from the scheduled send time, so a slow server
+shows up as latency instead of as a lower request rate. The server runs
+in-process over ASGI, as a local uvicorn started for the run, or is given
+by URL. Reports latency percentiles, throughput, error and 429 rates and
+server CPU/RSS per second, and saves them as JSON to compare runs.
+
+Usage:
+    python -m benchmarks.loadtest --rate 20 --duration 60                 # in-process
+    python -m benchmarks.loadtest --serve --rate 20 --concurrency 64      # local uvicorn
+    python -m benchmarks.loadtest --url http://127.0.0.1:8000 --pid 1234 --raw
+    python -m benchmarks.loadtest --rate 20 --compare reports/loadtest-old.json
+
+Needs httpx, and psutil for the CPU/RSS samples.
+"""
+
+import argparse
+import asyncio
+import base64
+import contextlib
+import glob
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+
+import httpx
+import numpy as np
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+IMAGE_EXTS = (".jpg", ".jpeg", ".png")
+REPORT_DIR = "reports"
+
+# ----------------------------
+# TARGETS
+# ----------------------------
+@contextlib.asynccontextmanager
+async def in_process():
+    """ASGI client for server.app with its lifespan running; yields (client, pid)."""
+    import server
+    async with server.app.router.lifespan_context(server.app):
+        transport = httpx.ASGITransport(app=server.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://loadtest") as client:
+            yield client, os.getpid()
+
+
+@contextlib.asynccontextmanager
+async def local_uvicorn(workers):
+    """Start uvicorn on a free port for the run; yields (client, pid)."""
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    proc = subprocess.Popen([sys.executable, "-m", "uvicorn", "server:app", "--port", str(port),
+                             "--workers", str(workers), "--log-level", "warning"])
+    try:
+        async with remote(f"http://127.0.0.1:{port}", proc.pid) as target:
+            yield target
+    finally:
+        proc.terminate()
+        proc.wait()
+
+
+@contextlib.asynccontextmanager
+async def remote(url, pid=None, timeout=120):
+    """Client for a running server, once it answers; yields (client, pid)."""
+    limits = httpx.Limits(max_connections=None, max_keepalive_connections=None)
+    async with httpx.AsyncClient(base_url=url, timeout=None, limits=limits, verify=False) as client:
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                await client.get("/")
+                break
+            except httpx.TransportError:
+                if time.monotonic() > deadline:
+                    raise
+                await asyncio.sleep(0.5)
+        yield client, pid
+
+# ----------------------------
+# SAMPLING
+# ----------------------------
+async def sample_server(pid, samples, interval=1.0):
+    """Append {"t", "cpu", "rss_mb"} for the server process (and its children) every second."""
+    if psutil is None or pid is None:
+        return
+    proc = psutil.Process(pid)
+    procs = {}
+    start = time.monotonic()
+    while True:
+        cpu, rss = 0.0, 0
+        for p in [proc] + proc.children(recursive=True):
+            p = procs.setdefault(p.pid, p)
+            try:
+                cpu += p.cpu_percent(None)  # since the last call; 0.0 the first time
+                rss += p.memory_info().rss
+            except psutil.Error:
+                continue
+        samples.append({"t": round(time.monotonic() - start, 1), "cpu": round(cpu, 1),
+                        "rss_mb": round(rss / 1e6, 1)})
+        await asyncio.sleep(interval)
+
+# ----------------------------
+# LOAD
+# ----------------------------
+def load_payloads(images_dir, raw):
+    paths = sorted(p for p in glob.glob(os.path.join(images_dir, "*"))
+                   if p.lower().endswith(IMAGE_EXTS))
+    if not paths:
+        raise SystemExit(f"No images in {images_dir}")
+    payloads = []
+    for path in paths:
+        with open(path, "rb") as f:
+            data = f.read()
+        payloads.append(data if raw else {"image_base64": base64.b64encode(data).decode()})
+    return payloads
+
+
+async def generate(client, payloads, args, records):
+    """Send requests on an open-loop schedule; append (t_scheduled, latency, status)."""
+    rnd = random.Random(args.seed)
+    slots = asyncio.Semaphore(args.concurrency)
+    headers = {"X-Priority": args.priority}
+    path = "/api/detect/raw" if args.raw else "/api/detect"
+    params = {"camera_id": args.camera_id} if args.raw and args.camera_id else None
+    start = time.monotonic()
+
+    async def one(scheduled, payload):
+        async with slots:
+            try:
+                if args.raw:
+                    r = await client.post(path, content=payload, headers=headers, params=params)
+                else:
+                    body = {**payload, "camera_id": args.camera_id} if args.camera_id else payload
+                    r = await client.post(path, json=body, headers=headers)
+                status = r.status_code
+            except httpx.HTTPError:
+                status = 0  # connection error / timeout
+        records.append((scheduled - start, time.monotonic() - scheduled, status))
+
+    tasks, t, i = [], start, 0
+    end = start + args.duration
+    while True:
+        # Poisson arrivals, or evenly spaced with --uniform
+        t += 1 / args.rate if args.uniform else rnd.expovariate(args.rate)
+        if t >= end:
+            break
+        await asyncio.sleep(max(0.0, t - time.monotonic()))
+        tasks.append(asyncio.create_task(one(t, payloads[i % len(payloads)])))
+        i += 1
+    await asyncio.gather(*tasks)
+    return time.monotonic() - start
+
+# ----------------------------
+# REPORT
+# ----------------------------
+def _percentiles(latencies):
+    if not latencies:
+        return None
+    ms = np.array(latencies) * 1000
+    return {f"p{q}": round(float(np.percentile(ms, q)), 1) for q in (50, 95, 99)} | \
+        {"max": round(float(ms.max()), 1)}
+
+
+def summarize(args, records, elapsed, samples):
+    statuses = {}
+    for _, _, status in records:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+    n = len(records)
+    answered = [lat for _, lat, status in records if status in (200, 422)]
+    per_second = []
+    for sec in range(int(np.ceil(elapsed))):
+        window = [r for r in records if sec <= r[0] < sec + 1]
+        per_second.append({"t": sec, "sent": len(window),
+                           "latency_ms": _percentiles([lat for _, lat, _ in window])})
+    cpu = [s["cpu"] for s in samples]
+    rss = [s["rss_mb"] for s in samples]
+    return {
+        "config": {k: getattr(args, k) for k in ("target", "rate", "duration", "concurrency",
+                                                 "raw", "priority", "camera_id", "uniform")},
+        "started": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(time.time() - elapsed)),
+        "commit": _git_commit(),
+        "host_cpus": os.cpu_count(),
+        "summary": {
+            "requests": n,
+            "throughput_rps": round(len(answered) / elapsed, 2) if elapsed else 0.0,
+            "status": statuses,
+            "error_rate": round(sum(v for k, v in statuses.items() if k not in ("200", "422", "429"))
+                                / n, 4) if n else 0.0,
+            "rate_429": round(statuses.get("429", 0) / n, 4) if n else 0.0,
+            "latency_ms": _percentiles(answered),
+            "cpu_percent": {"mean": round(float(np.mean(cpu)), 1), "max": max(cpu)} if cpu else None,
+            "rss_mb": {"mean": round(float(np.mean(rss)), 1), "max": max(rss)} if rss else None,
+        },
+        "per_second": per_second,
+        "server": samples,
+    }
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+# (label, path into "summary") of the figures compared between runs
+COMPARED = [
+    ("throughput rps", ("throughput_rps",)),
+    ("p50 ms", ("latency_ms", "p50")),
+    ("p95 ms", ("latency_ms", "p95")),
+    ("p99 ms", ("latency_ms", "p99")),
+    ("error rate", ("error_rate",)),
+    ("429 rate", ("rate_429",)),
+    ("cpu % mean", ("cpu_percent", "mean")),
+    ("rss MB max", ("rss_mb", "max")),
+]
+
+
+def _get(summary, keys):
+    for k in keys:
+        summary = summary.get(k) if isinstance(summary, dict) else None
+    return summary
+
+
+def print_report(report, baseline=None):
+    s = report["summary"]
+    print(f"{s['requests']} requests, status {s['status']}")
+    header = f"{'':<16}{'this run':>12}"
+    if baseline:
+        header += f"{'baseline':>12}{'change':>10}"
+    print(header)
+    for label, keys in COMPARED:
+        value = _get(s, keys)
+        line = f"{label:<16}{'-' if value is None else value:>12}"
+        if baseline:
+            old = _get(baseline["summary"], keys)
+            change = f"{(value - old) / old:+.0%}" if value is not None and old else ""
+            line += f"{'-' if old is None else old:>12}{change:>10}"
+        print(line)
+
+
+async def run(args):
+    payloads = load_payloads(args.images, args.raw)
+    if args.url:
+        target = remote(args.url, args.pid)
+    elif args.serve:
+        target = local_uvicorn(args.workers)
+    else:
+        target = in_process()
+
+    records, samples = [], []
+    async with target as (client, pid):
+        sampler = asyncio.create_task(sample_server(pid, samples))
+        try:
+            elapsed = await generate(client, payloads, args, records)
+        finally:
+            sampler.cancel()
+    return summarize(args, records, elapsed, samples)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    where = parser.add_mutually_exclusive_group()
+    where.add_argument("--url", help="load a running server instead of one in-process")
+    where.add_argument("--serve", action="store_true", help="start a local uvicorn for the run")
+    parser.add_argument("--pid", type=int, help="server process to sample, with --url")
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn workers, with --serve")
+    parser.add_argument("--images", default="images", help="directory of images to replay")
+    parser.add_argument("--raw", action="store_true",
+                        help="send image bytes to /api/detect/raw instead of base64 JSON")
+    parser.add_argument("--rate", type=float, default=10.0, help="requests per second")
+    parser.add_argument("--duration", type=float, default=30.0, help="seconds of load")
+    parser.add_argument("--concurrency", type=int, default=256, help="max requests in flight")
+    parser.add_argument("--uniform", action="store_true", help="even spacing instead of Poisson")
+    parser.add_argument("--priority", default="high", choices=["high", "low"])
+    parser.add_argument("--camera-id", help="camera_id sent with every request")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("-o", "--output", help="report file (default: reports/loadtest-<time>.json)")
+    parser.add_argument("--compare", metavar="REPORT", help="print changes against an earlier report")
+    args = parser.parse_args(argv)
+    args.target = args.url or ("uvicorn" if args.serve else "in-process")
+
+    if psutil is None:
+        print("psutil is not installed: no CPU/RSS samples.", file=sys.stderr)
+    report = asyncio.run(run(args))
+
+    output = args.output or os.path.join(
+        REPORT_DIR, f"loadtest-{report['started'].replace(':', '')}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=1)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    print_report(report, baseline)
+    print(f"Report saved to {output}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
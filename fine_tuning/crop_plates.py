@@ -1,6 +1,29 @@
+"""
+Crop plates out of the raw dataset using its YOLO label files.
+
+Images are processed across a process pool; each image is decoded once for
+all of its label lines, and images whose pixels and labels are unchanged
+since the last run are skipped. Crops are registered in the manifest so
+later stages never rescan the output directory; crops of images that were
+deleted or lost their label file are removed from it. An image that fails
+to decode keeps its existing crops until it crops cleanly again.
+
+Usage:
+    python -m fine_tuning.crop_plates [--format png|jpg] [--workers N] [--force]
+"""
+
+import argparse
+import hashlib
+import io
 import os
+from multiprocessing import Pool
+
 from PIL import Image
 
+from .manifest import (
+    abspath, check_file, connect, forget_file, record_file, relpath, remove_samples, upsert_sample,
+)
+
 # ----------------------------
 # CONFIG
 # ----------------------------
@@ -9,10 +32,16 @@ DATASET_DIR = os.path.join(BASE_DIR, "dataset")
 IMAGES_DIR = os.path.join(DATASET_DIR, "images")
 LABELS_DIR = os.path.join(DATASET_DIR, "labels")
 OUTPUT_DIR = os.path.join(DATASET_DIR, "cropped")
-os.makedirs(OUTPUT_DIR, exist_ok=True)
 
 VALID_EXTS = [".jpg", ".jpeg", ".png"]
 
+# Crop encodings: PNG is lossless, JPEG only for when disk space matters more
+FORMATS = {
+    "png": (".png", {"format": "PNG", "compress_level": 1}),
+    "jpg": (".jpg", {"format": "JPEG", "quality": 95}),
+}
+DEFAULT_FORMAT = "png"
+
 # ----------------------------
 # HELPER FUNCTION
 # ----------------------------
@@ -24,52 +53,194 @@ def yolo_to_bbox(yolo_line, img_width, img_height):
     parts = yolo_line.strip().split()
     if len(parts) != 5:
         raise ValueError(f"Invalid YOLO label line: {yolo_line}")
-    
+
     _, x_center, y_center, w, h = map(float, parts)
-    
+
     x_min = int((x_center - w/2) * img_width)
     y_min = int((y_center - h/2) * img_height)
     x_max = int((x_center + w/2) * img_width)
     y_max = int((y_center + h/2) * img_height)
-    
+
     # Clamp to image size
     x_min = max(0, x_min)
     y_min = max(0, y_min)
     x_max = min(img_width, x_max)
     y_max = min(img_height, y_max)
-    
+
     return x_min, y_min, x_max, y_max
 
+
+def crop_image(task):
+    """
+    Worker: decode one image and write a crop for every label line.
+    Returns (image_path, label_path, crops, errors) where crops is a list of
+    (sample_id, bbox, out_path, sha1).
+    """
+    image_path, label_path, output_dir, fmt = task
+    ext, save_kwargs = FORMATS[fmt]
+    stem = os.path.splitext(os.path.basename(image_path))[0]
+    crops, errors = [], []
+
+    try:
+        with open(label_path, "r") as f:
+            lines = [line for line in f if line.strip()]
+
+        with Image.open(image_path) as img:
+            img.load()  # decode once, crop many
+            if img.mode != "RGB":
+                img = img.convert("RGB")  # e.g. CMYK JPEGs, which PNG can't store
+                img.info.pop("icc_profile", None)  # describes the old color space
+            w, h = img.size
+
+            for i, line in enumerate(lines, start=1):
+                try:
+                    bbox = yolo_to_bbox(line, w, h)
+                    buf = io.BytesIO()
+                    img.crop(bbox).save(buf, **save_kwargs)
+                    data = buf.getvalue()
+
+                    sample_id = f"{stem}_plate{i}"
+                    out_path = os.path.join(output_dir, sample_id + ext)
+                    with open(out_path, "wb") as out:
+                        out.write(data)
+                    crops.append((sample_id, bbox, out_path, hashlib.sha1(data).hexdigest()))
+                except Exception as e:
+                    errors.append(f"Error processing line {i} in {label_path}: {e}")
+    except Exception as e:
+        errors.append(f"Error processing {image_path}: {e}")
+
+    return image_path, label_path, crops, errors
+
+
+def _up_to_date(conn, image_path, label_path, existing, ext):
+    """
+    Whether neither input changed and all known crops exist in the wanted
+    format. Returns (up_to_date, states): the inputs' new file states, to be
+    recorded together with the crops, so a crash in between redoes the image.
+    """
+    image_changed, image_state = check_file(conn, image_path)
+    label_changed, label_state = check_file(conn, label_path)
+    states = [image_state, label_state]
+    if image_changed or label_changed:
+        return False, states
+    crops = existing.get(relpath(image_path))
+    return bool(crops) and all(
+        path.endswith(ext) and os.path.exists(abspath(path)) for path in crops.values()
+    ), states
+
+def _drop_crops(conn, crops, kept=()):
+    """Delete crop files, and the samples of those not in `kept`."""
+    remove_samples(conn, [sid for sid in crops if sid not in kept])
+    for path in crops.values():
+        if os.path.exists(abspath(path)):
+            os.remove(abspath(path))
+
 # ----------------------------
-# MAIN LOOP
+# MAIN
 # ----------------------------
-for fname in os.listdir(IMAGES_DIR):
-    if not any(fname.lower().endswith(ext) for ext in VALID_EXTS):
-        continue
+def crop_plates(images_dir=IMAGES_DIR, labels_dir=LABELS_DIR, output_dir=OUTPUT_DIR,
+                fmt=DEFAULT_FORMAT, workers=None, force=False, conn=None):
+    """
+    Crop every labelled plate into `output_dir` and record it in the manifest.
+    Returns the number of images (re)processed.
+    """
+    conn = conn or connect()
+    os.makedirs(output_dir, exist_ok=True)
+    ext = FORMATS[fmt][0]
 
-    image_path = os.path.join(IMAGES_DIR, fname)
-    label_path = os.path.join(LABELS_DIR, os.path.splitext(fname)[0] + ".txt")
-    
-    if not os.path.exists(label_path):
-        print(f"Label file not found for {fname}, skipping.")
-        continue
+    # source -> {sample_id: crop path}, loaded once instead of per image
+    existing = {}
+    for row in conn.execute("SELECT id, source, path FROM samples"):
+        existing.setdefault(row["source"], {})[row["id"]] = row["path"]
 
-    with Image.open(image_path) as img:
-        w, h = img.size
+    tasks, states, sources = [], {}, set()
+    for entry in os.scandir(images_dir):
+        fname = entry.name
+        if not any(fname.lower().endswith(e) for e in VALID_EXTS):
+            continue
 
-        with open(label_path, "r") as f:
-            lines = f.readlines()
-
-        for i, line in enumerate(lines, start=1):
-            try:
-                x_min, y_min, x_max, y_max = yolo_to_bbox(line, w, h)
-                cropped = img.crop((x_min, y_min, x_max, y_max))
-                
-                out_fname = f"{os.path.splitext(fname)[0]}_plate{i}.jpg"
-                out_path = os.path.join(OUTPUT_DIR, out_fname)
-                cropped.save(out_path)
-                print(f"Cropped {out_fname}")
-            except Exception as e:
-                print(f"Error processing line in {label_path}: {e}")
-
-print("Cropping complete.")
+        label_path = os.path.join(labels_dir, os.path.splitext(fname)[0] + ".txt")
+        if not os.path.exists(label_path):
+            print(f"Label file not found for {fname}, skipping.")
+            continue
+        sources.add(relpath(entry.path))
+
+        up_to_date, file_states = _up_to_date(conn, entry.path, label_path, existing, ext)
+        if up_to_date and not force:
+            # Only a new mtime on unchanged content to note
+            for state in file_states:
+                record_file(conn, state)
+            continue
+        states[entry.path] = file_states
+        tasks.append((entry.path, label_path, output_dir, fmt))
+
+    # Drop crops whose source image or label file was deleted
+    images_dir = os.path.abspath(images_dir)
+    orphaned = [
+        source for source in existing if source not in sources and (
+            os.path.dirname(os.path.normpath(abspath(source))) == images_dir
+            or not os.path.exists(abspath(source))
+        )
+    ]
+    for source in orphaned:
+        _drop_crops(conn, existing.pop(source))
+    if orphaned:
+        print(f"Removed crops of {len(orphaned)} deleted or unlabelled images.")
+    conn.commit()
+
+    print(f"{len(tasks)} images to crop.")
+    if not tasks:
+        return 0
+
+    done = 0
+    with Pool(workers) as pool:
+        for image_path, label_path, crops, errors in pool.imap_unordered(
+            crop_image, tasks, chunksize=16
+        ):
+            for err in errors:
+                print(err)
+            if errors:
+                # Retry this image on the next run; keep its existing crops
+                # (and their labels) rather than reconcile against a partial set
+                forget_file(conn, image_path)
+                forget_file(conn, label_path)
+            else:
+                # In the same transaction as the crops below
+                for state in states.pop(image_path):
+                    record_file(conn, state)
+
+                for sample_id, bbox, out_path, sha1 in crops:
+                    upsert_sample(conn, sample_id, image_path, bbox, out_path, sha1)
+
+                # Drop crops for label lines that disappeared or changed format
+                kept = {sample_id: relpath(out_path) for sample_id, _, out_path, _ in crops}
+                old = existing.get(relpath(image_path), {})
+                _drop_crops(conn, {
+                    sid: path for sid, path in old.items() if kept.get(sid) != path
+                }, kept)
+
+            done += 1
+            if done % 500 == 0:
+                conn.commit()
+                print(f"Cropped {done}/{len(tasks)} images")
+
+    conn.commit()
+    return done
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Crop plates from the YOLO-labelled dataset.")
+    parser.add_argument("--images", default=IMAGES_DIR, help="directory of raw frames")
+    parser.add_argument("--labels", default=LABELS_DIR, help="directory of YOLO label files")
+    parser.add_argument("--output", default=OUTPUT_DIR, help="directory for crops")
+    parser.add_argument("--format", choices=sorted(FORMATS), default=DEFAULT_FORMAT)
+    parser.add_argument("--workers", type=int, default=None, help="processes (default: all CPUs)")
+    parser.add_argument("--force", action="store_true", help="re-crop even unchanged images")
+    args = parser.parse_args()
+
+    done = crop_plates(args.images, args.labels, args.output, args.format, args.workers, args.force)
+    print(f"Cropping complete. {done} images processed.")
+
+
+if __name__ == "__main__":
+    main()
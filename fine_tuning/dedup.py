@@ -0,0 +1,217 @@
+"""
+Near-duplicate removal for cropped plates.
+
+Crops come from video-like captures, so the same plate appears in many
+almost identical frames. This stage hashes every crop with a perceptual hash
+(dHash or pHash, computed in batches with numpy), finds pairs within a
+Hamming distance using multi-index hashing, and groups them into clusters.
+One representative per cluster is kept, preferring crops that have not
+failed validation; the rest are flagged as duplicates and skipped by
+transcription, boxing and training. Each hash is stored with the method
+that produced it, so switching methods rehashes. New crops join their
+cluster's train/eval split, so near-identical frames stay on one side.
+
+Usage:
+    python -m fine_tuning.dedup [--method dhash|phash] [--max-distance N] [--keep-all]
+"""
+
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+from .manifest import abspath, connect
+
+# ----------------------------
+# CONFIG
+# ----------------------------
+HASH_SIZE = 8               # 8x8 = 64-bit hashes
+MAX_DISTANCE = 3            # Hamming distance still considered a duplicate
+BATCH_SIZE = 4096
+
+# ----------------------------
+# PERCEPTUAL HASHES
+# ----------------------------
+def _pack(bits):
+    """(N, 64) bool -> (N,) uint64."""
+    return np.packbits(bits, axis=1).view(">u8").ravel().astype(np.uint64)
+
+
+def dhash(images):
+    """Difference hash of a batch of grayscale images."""
+    small = np.stack([
+        cv2.resize(img, (HASH_SIZE + 1, HASH_SIZE), interpolation=cv2.INTER_AREA)
+        for img in images
+    ])
+    bits = small[:, :, 1:] > small[:, :, :-1]
+    return _pack(bits.reshape(len(images), -1))
+
+
+def _dct_matrix(n):
+    k = np.arange(n)[:, None]
+    m = np.cos(np.pi * (2 * np.arange(n)[None, :] + 1) * k / (2 * n))
+    m[0] *= 1 / np.sqrt(2)
+    return (m * np.sqrt(2 / n)).astype(np.float32)
+
+
+def phash(images, size=32):
+    """DCT-based perceptual hash of a batch of grayscale images."""
+    small = np.stack([
+        cv2.resize(img, (size, size), interpolation=cv2.INTER_AREA) for img in images
+    ]).astype(np.float32)
+    dct = _dct_matrix(size)
+    coeffs = dct @ small @ dct.T                     # batched 2-D DCT
+    low = coeffs[:, :HASH_SIZE, :HASH_SIZE].reshape(len(images), -1)
+    median = np.median(low[:, 1:], axis=1, keepdims=True)  # skip the DC term
+    return _pack(low > median)
+
+
+HASHES = {"dhash": dhash, "phash": phash}
+
+# ----------------------------
+# NEAR-DUPLICATE SEARCH
+# ----------------------------
+def _chunk_keys(hashes, chunks):
+    """Split 64-bit hashes into `chunks` roughly equal bit ranges."""
+    bounds = np.linspace(0, 64, chunks + 1).astype(int)
+    for lo, hi in zip(bounds[:-1], bounds[1:]):
+        mask = np.uint64((1 << (hi - lo)) - 1)
+        yield (hashes >> np.uint64(lo)) & mask
+
+
+def near_duplicate_pairs(hashes, max_distance=MAX_DISTANCE, block=1024):
+    """
+    Yield (i, j) index arrays of pairs within `max_distance` bits.
+
+    Multi-index hashing: with the hash cut into max_distance + 1 chunks, any
+    two hashes that close must agree exactly on at least one chunk, so only
+    hashes sharing a chunk value are compared.
+    """
+    hashes = np.asarray(hashes, dtype=np.uint64)
+    for keys in _chunk_keys(hashes, max_distance + 1):
+        order = np.argsort(keys, kind="stable")
+        sorted_keys = keys[order]
+        starts = np.flatnonzero(np.r_[True, sorted_keys[1:] != sorted_keys[:-1]])
+        ends = np.r_[starts[1:], len(keys)]
+
+        for start, end in zip(starts, ends):
+            if end - start < 2:
+                continue
+            group = order[start:end]
+            hg = hashes[group]
+            for row in range(0, len(group), block):
+                dist = np.bitwise_count(hg[row:row + block, None] ^ hg[None, :])
+                a, b = np.nonzero(dist <= max_distance)
+                keep = group[row + a] < group[b]
+                if keep.any():
+                    yield group[row + a[keep]], group[b[keep]]
+
+
+def cluster(hashes, max_distance=MAX_DISTANCE):
+    """Connected components of the near-duplicate graph; returns a root per index."""
+    parent = list(range(len(hashes)))
+
+    def find(x):
+        while parent[x] != x:
+            parent[x] = parent[parent[x]]
+            x = parent[x]
+        return x
+
+    for a, b in near_duplicate_pairs(hashes, max_distance):
+        for i, j in zip(a.tolist(), b.tolist()):
+            ri, rj = find(i), find(j)
+            if ri != rj:
+                parent[max(ri, rj)] = min(ri, rj)
+
+    return [find(i) for i in range(len(hashes))]
+
+# ----------------------------
+# MAIN
+# ----------------------------
+def _load_gray(path):
+    return cv2.imread(path, cv2.IMREAD_GRAYSCALE)
+
+
+def hash_pending(conn, method="dhash", rehash=False):
+    """Hash crops with no `method` hash yet (or all of them with `rehash`)."""
+    query = "SELECT id, path FROM samples WHERE path IS NOT NULL"
+    args = ()
+    if not rehash:
+        query += " AND (phash IS NULL OR phash_method IS NOT ?)"
+        args = (method,)
+    rows = conn.execute(query, args).fetchall()
+    hash_fn = HASHES[method]
+
+    with ThreadPoolExecutor() as pool:  # cv2 releases the GIL while decoding
+        for start in range(0, len(rows), BATCH_SIZE):
+            batch = rows[start:start + BATCH_SIZE]
+            images = list(pool.map(_load_gray, (abspath(r["path"]) for r in batch)))
+            ok = [(r, img) for r, img in zip(batch, images) if img is not None and img.size]
+            for r, img in zip(batch, images):
+                if img is None or not img.size:
+                    print(f"Could not read {r['path']}, skipping.")
+            if not ok:
+                continue
+
+            hashes = hash_fn([img for _, img in ok]).view(np.int64)  # SQLite stores signed
+            conn.executemany(
+                "UPDATE samples SET phash = ?, phash_method = ? WHERE id = ?",
+                [(int(h), method, r["id"]) for (r, _), h in zip(ok, hashes)],
+            )
+            conn.commit()
+    return len(rows)
+
+
+def dedup(conn, method="dhash", max_distance=MAX_DISTANCE, keep_all=False, rehash=False):
+    """
+    Hash new crops, recluster the whole set and flag duplicates.
+    Returns (samples, clusters) counts.
+    """
+    hashed = hash_pending(conn, method, rehash)
+    print(f"Hashed {hashed} crops.")
+
+    # Prefer validated, then not yet checked, then larger (sharper) crops as
+    # representatives; a representative that fails validation is replaced on
+    # the next run, so the rest of its cluster still gets transcribed
+    rows = conn.execute(
+        """
+        SELECT id, phash FROM samples WHERE phash IS NOT NULL AND phash_method = ?
+        ORDER BY valid IS 1 DESC, valid IS 0, (x_max - x_min) * (y_max - y_min) DESC, id
+        """,
+        (method,),
+    ).fetchall()
+    if not rows:
+        return 0, 0
+
+    hashes = np.array([r["phash"] for r in rows], dtype=np.int64).view(np.uint64)
+    roots = cluster(hashes, max_distance)
+
+    # Roots are the smallest index in each component, i.e. the best-ranked row
+    updates = []
+    for row, root in zip(rows, roots):
+        rep = rows[root]["id"]
+        duplicate = int(rep != row["id"] and not keep_all)
+        updates.append((rep, duplicate, row["id"]))
+    conn.executemany("UPDATE samples SET cluster = ?, duplicate = ? WHERE id = ?", updates)
+    conn.commit()
+
+    return len(rows), len(set(roots))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Flag near-duplicate plate crops.")
+    parser.add_argument("--method", choices=sorted(HASHES), default="dhash")
+    parser.add_argument("--max-distance", type=int, default=MAX_DISTANCE)
+    parser.add_argument("--keep-all", action="store_true",
+                        help="cluster for the split only, keep every crop for training")
+    parser.add_argument("--rehash", action="store_true", help="recompute every hash")
+    args = parser.parse_args()
+
+    samples, clusters = dedup(connect(), args.method, args.max_distance, args.keep_all, args.rehash)
+    print(f"Dedup complete. {samples} crops in {clusters} clusters "
+          f"({samples - clusters} near-duplicates).")
+
+
+if __name__ == "__main__":
+    main()
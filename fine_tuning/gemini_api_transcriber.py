@@ -1,96 +1,332 @@
+"""
+Transcribe cropped plates into labels with a vision model.
+
+Requests run concurrently under a token bucket that honours both the
+requests-per-minute and requests-per-day quotas. Rate-limit (429) and server
+(5xx) errors are retried with exponential backoff. Labels, the daily request
+count and the bucket level are all stored in the manifest, so a restarted run
+resumes exactly where the last one stopped without exceeding the quota.
+
+The model is called through a pluggable backend: Gemini by default, or any
+HTTP endpoint speaking the small JSON protocol of `HTTPBackend` (handy for
+testing against a local stand-in server).
+
+Usage:
+    python -m fine_tuning.gemini_api_transcriber [--concurrency N]
+    python -m fine_tuning.gemini_api_transcriber --backend http --url http://127.0.0.1:8080/
+"""
+
+import argparse
+import asyncio
+import base64
+import datetime
+import json
 import os
+import random
 import time
-from google import genai
-from google.genai import types
+import urllib.error
+import urllib.request
+from zoneinfo import ZoneInfo
+
 from dotenv import load_dotenv
-import shutil
+
+from .manifest import abspath, connect, import_labels, set_label
 
 # ----------------------------
 # CONFIGURATION
 # ----------------------------
-load_dotenv()
-API_KEY = os.getenv("GEMINI_API_KEY_4")
-if not API_KEY:
-    raise ValueError("GEMINI_API_KEY not found in environment variables.")
-
-client = genai.Client(api_key=API_KEY)
-
-INPUT_DIR = os.path.join(os.path.dirname(__file__), "dataset", "cropped")
-OUTPUT_DIR = os.path.join(os.path.dirname(__file__), "training_data")
-os.makedirs(OUTPUT_DIR, exist_ok=True)
+# Legacy output of earlier runs; its .gt.txt files are imported into the manifest
+LEGACY_GT_DIR = os.path.join(os.path.dirname(__file__), "training_data")
 
 MODEL = "gemini-2.5-flash-lite"     # use Lite for higher limits
 RPM_LIMIT = 15                      # requests per minute
 RPD_LIMIT = 1000                    # requests per day
-SLEEP_TIME = 60 / RPM_LIMIT         # ~4 sec between requests
+CONCURRENCY = 4                     # requests in flight
+MAX_RETRIES = 5
+BACKOFF_BASE = 2.0                  # seconds, doubled per retry
+QUOTA_TZ = ZoneInfo("America/Los_Angeles")  # Gemini daily quotas reset at Pacific midnight
+
+PROMPT = "Extract the license plate number. Return only A-Z and 0-9, no spaces or punctuation."
+
+MIME_TYPES = {".jpg": "image/jpeg", ".jpeg": "image/jpeg", ".png": "image/png"}
+
+# Crops still to transcribe: unlabelled, and not dropped as near-duplicates
+PENDING_QUERY = (
+    "SELECT id, path FROM samples "
+    "WHERE label IS NULL AND path IS NOT NULL AND duplicate IS NOT 1 ORDER BY id"
+)
+
+_STATE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS transcriber_state (
+    key   TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+# ----------------------------
+# ERRORS
+# ----------------------------
+class TranscribeError(Exception):
+    """A failed backend call; `status` is the HTTP status when known."""
+
+    def __init__(self, message, status=None, retry_after=None):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+
+    @property
+    def retryable(self):
+        # Connection errors have no status and are worth retrying too
+        return self.status is None or self.status == 429 or self.status >= 500
+
+
+class QuotaExhausted(Exception):
+    """The daily request quota has been used up."""
+
+# ----------------------------
+# BACKENDS
+# ----------------------------
+class GeminiBackend:
+    """Calls the Gemini API through the async google-genai client."""
+
+    def __init__(self, api_key, model=MODEL):
+        from google import genai
+
+        self._client = genai.Client(api_key=api_key)
+        self.model = model
+
+    async def transcribe(self, image_bytes, mime):
+        import httpx  # the google-genai client's transport
+        from google.genai import errors, types
+
+        try:
+            response = await self._client.aio.models.generate_content(
+                model=self.model,
+                contents=[types.Part.from_bytes(data=image_bytes, mime_type=mime), PROMPT],
+            )
+        except errors.APIError as e:
+            raise TranscribeError(str(e), e.code, _retry_delay(e.details)) from e
+        except (httpx.TransportError, TimeoutError, OSError) as e:
+            raise TranscribeError(str(e) or type(e).__name__) from e
+        return response.text or ""
+
+
+def _retry_delay(details):
+    """Seconds from a google.rpc.RetryInfo detail (e.g. "retryDelay": "30s"), if any."""
+    error = details.get("error", details) if isinstance(details, dict) else None
+    if not isinstance(error, dict):
+        return None
+    for detail in error.get("details") or ():
+        delay = detail.get("retryDelay") if isinstance(detail, dict) else None
+        if isinstance(delay, str) and delay.endswith("s"):
+            try:
+                return float(delay[:-1])
+            except ValueError:
+                pass
+    return None
+
+
+class HTTPBackend:
+    """
+    POSTs {"image_base64", "mime_type", "prompt"} as JSON to `url` and
+    expects {"text": "..."} back.
+    """
+
+    def __init__(self, url, timeout=30):
+        self.url = url
+        self.timeout = timeout
+
+    async def transcribe(self, image_bytes, mime):
+        payload = json.dumps({
+            "image_base64": base64.b64encode(image_bytes).decode("ascii"),
+            "mime_type": mime,
+            "prompt": PROMPT,
+        }).encode("utf-8")
+        return await asyncio.to_thread(self._post, payload)
+
+    def _post(self, payload):
+        req = urllib.request.Request(
+            self.url, data=payload, headers={"Content-Type": "application/json"}
+        )
+        try:
+            with urllib.request.urlopen(req, timeout=self.timeout) as resp:
+                return json.loads(resp.read())["text"]
+        except urllib.error.HTTPError as e:
+            retry_after = e.headers.get("Retry-After")
+            raise TranscribeError(
+                f"HTTP {e.code}: {e.reason}", e.code,
+                float(retry_after) if retry_after and retry_after.isdigit() else None,
+            ) from e
+        except (urllib.error.URLError, TimeoutError, ConnectionError) as e:
+            raise TranscribeError(str(e)) from e
 
 # ----------------------------
-# HELPER FUNCTION
+# RATE LIMITER
 # ----------------------------
-def transcribe_plate(image_path):
-    """Send a single cropped plate image to Gemini and return the plate text."""
+class RateLimiter:
+    """
+    Token bucket refilled at `rpm` per minute plus a daily request counter.
+    Both are persisted after every grant so restarts neither reset the daily
+    count nor burst past the per-minute limit.
+    """
+
+    def __init__(self, conn, rpm, rpd):
+        self.conn = conn
+        self.rate = rpm / 60.0
+        self.capacity = float(rpm)
+        self.rpd = rpd
+        self._lock = asyncio.Lock()
+
+        conn.executescript(_STATE_SCHEMA)
+        state = self._load("bucket")
+        if state:
+            elapsed = max(0.0, time.time() - state["at"])
+            self.tokens = min(self.capacity, state["tokens"] + elapsed * self.rate)
+        else:
+            self.tokens = self.capacity
+        self._at = time.time()
+
+    def _load(self, key):
+        row = self.conn.execute(
+            "SELECT value FROM transcriber_state WHERE key = ?", (key,)
+        ).fetchone()
+        return json.loads(row["value"]) if row else None
+
+    def _save(self, key, value):
+        self.conn.execute(
+            "INSERT INTO transcriber_state (key, value) VALUES (?, ?) "
+            "ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+            (key, json.dumps(value)),
+        )
+
+    @staticmethod
+    def _today():
+        return datetime.datetime.now(QUOTA_TZ).date().isoformat()
+
+    def used_today(self):
+        state = self._load("daily")
+        return state["used"] if state and state["day"] == self._today() else 0
+
+    def _refill(self):
+        now = time.time()
+        self.tokens = min(self.capacity, self.tokens + (now - self._at) * self.rate)
+        self._at = now
+
+    async def acquire(self):
+        """Wait for a request slot; raises QuotaExhausted once RPD is reached."""
+        async with self._lock:
+            used = self.used_today()
+            if used >= self.rpd:
+                raise QuotaExhausted()
+
+            self._refill()
+            while self.tokens < 1.0:
+                await asyncio.sleep((1.0 - self.tokens) / self.rate)
+                self._refill()
+            self.tokens -= 1.0
+
+            self._save("bucket", {"tokens": self.tokens, "at": self._at})
+            self._save("daily", {"day": self._today(), "used": used + 1})
+            self.conn.commit()
+
+# ----------------------------
+# TRANSCRIPTION
+# ----------------------------
+async def transcribe_plate(backend, limiter, image_path, max_retries=MAX_RETRIES):
+    """Send one cropped plate to the backend and return the normalized plate text."""
     ext = os.path.splitext(image_path)[1].lower()
-    if ext in [".jpg", ".jpeg"]:
-        mime = "image/jpeg"
-    elif ext == ".png":
-        mime = "image/png"
-    else:
+    mime = MIME_TYPES.get(ext)
+    if mime is None:
         raise ValueError(f"Unsupported image format: {image_path}")
 
     with open(image_path, "rb") as f:
         image_bytes = f.read()
 
-    response = client.models.generate_content(
-        model=MODEL,
-        contents=[
-            types.Part.from_bytes(data=image_bytes, mime_type=mime),
-            "Extract the license plate number. Return only A-Z and 0-9, no spaces or punctuation."
-        ]
-    )
-    # Normalize: remove spaces, uppercase
-    return response.text.strip().replace(" ", "").upper()
+    for attempt in range(max_retries + 1):
+        await limiter.acquire()
+        try:
+            text = await backend.transcribe(image_bytes, mime)
+            # Normalize: remove spaces, uppercase
+            return text.strip().replace(" ", "").upper()
+        except TranscribeError as e:
+            if not e.retryable or attempt == max_retries:
+                raise
+            delay = e.retry_after or BACKOFF_BASE * 2 ** attempt
+            await asyncio.sleep(delay * random.uniform(0.8, 1.2))
 
-# ----------------------------
-# MAIN LOOP
-# ----------------------------
-image_files = [f for f in os.listdir(INPUT_DIR) if f.lower().endswith((".jpg", ".jpeg", ".png"))]
-processed_today = 0
 
-for idx, fname in enumerate(sorted(image_files), start=1):
-    base = os.path.splitext(fname)[0]
-    gt_path = os.path.join(OUTPUT_DIR, f"{base}.gt.txt")
-    out_img_path = os.path.join(OUTPUT_DIR, fname)
+async def transcribe_pending(conn, backend, rpm=RPM_LIMIT, rpd=RPD_LIMIT, concurrency=CONCURRENCY):
+    """
+    Label every crop in the manifest that has no label yet.
+    Returns the number of crops labelled in this run.
+    """
+    limiter = RateLimiter(conn, rpm, rpd)
+
+    # Resume capability: only crops without a label are sent, duplicates never
+    pending = conn.execute(PENDING_QUERY).fetchall()
+    print(f"{len(pending)} crops to transcribe, {limiter.used_today()}/{rpd} requests used today.")
+
+    queue = asyncio.Queue()
+    for row in pending:
+        queue.put_nowait(row)
+    done = 0
 
-    # Skip if both GT and image already exist (resume capability)
-    if os.path.exists(gt_path) and os.path.exists(out_img_path):
-        print(f"[{idx}/{len(image_files)}] Skipping {fname}, already processed.")
-        continue
+    async def worker():
+        nonlocal done
+        while not queue.empty():
+            row = queue.get_nowait()
+            try:
+                plate_text = await transcribe_plate(backend, limiter, abspath(row["path"]))
+            except QuotaExhausted:
+                # Drain the queue so the other workers stop too
+                while not queue.empty():
+                    queue.get_nowait()
+                return
+            except Exception as e:
+                print(f"Error processing {row['id']}: {e}")
+                continue
 
-    if processed_today >= RPD_LIMIT:
-        print("Reached daily request limit (1000). Stop here and resume tomorrow.")
-        break
+            set_label(conn, row["id"], plate_text)
+            conn.commit()
+            done += 1
+            print(f"[{done}/{len(pending)}] {row['id']} → {plate_text}")
 
-    image_path = os.path.join(INPUT_DIR, fname)
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
 
-    try:
-        plate_text = transcribe_plate(image_path)
-    except Exception as e:
-        print(f"[{idx}/{len(image_files)}] Error processing {fname}: {e}")
-        continue
+    if limiter.used_today() >= rpd and done < len(pending):
+        print(f"Reached daily request limit ({rpd}). Run again after the quota resets.")
+    return done
 
-    # Save GT file if missing
-    if not os.path.exists(gt_path):
-        with open(gt_path, "w") as f:
-            f.write(plate_text)
 
-    # Copy image if missing
-    if not os.path.exists(out_img_path):
-        shutil.copy(image_path, out_img_path)
+def main():
+    parser = argparse.ArgumentParser(description="Transcribe cropped plates into labels.")
+    parser.add_argument("--backend", choices=["gemini", "http"], default="gemini")
+    parser.add_argument("--url", help="endpoint for the http backend")
+    parser.add_argument("--model", default=MODEL)
+    parser.add_argument("--rpm", type=int, default=RPM_LIMIT)
+    parser.add_argument("--rpd", type=int, default=RPD_LIMIT)
+    parser.add_argument("--concurrency", type=int, default=CONCURRENCY)
+    args = parser.parse_args()
+
+    if args.backend == "http":
+        if not args.url:
+            parser.error("--url is required with --backend http")
+        backend = HTTPBackend(args.url)
+    else:
+        load_dotenv()
+        api_key = os.getenv("GEMINI_API_KEY_4")
+        if not api_key:
+            raise ValueError("GEMINI_API_KEY not found in environment variables.")
+        backend = GeminiBackend(api_key, args.model)
+
+    conn = connect()
+    imported = import_labels(conn, LEGACY_GT_DIR)
+    if imported:
+        print(f"Imported {imported} existing transcriptions from {LEGACY_GT_DIR}")
 
-    processed_today += 1
-    print(f"[{idx}/{len(image_files)}] {fname} → {plate_text}")
+    done = asyncio.run(transcribe_pending(conn, backend, args.rpm, args.rpd, args.concurrency))
+    print(f"Done. Processed {done} new images today.")
 
-    # Respect RPM limit
-    time.sleep(SLEEP_TIME)
 
-print(f"Done. Processed {processed_today} new images today.")
+if __name__ == "__main__":
+    main()
@@ -1,58 +1,72 @@
 import os
-import shutil
-from PIL import Image
+
+from .manifest import BOXED_DIR, abspath, connect, materialize, remove_box_files, set_boxed
 
 # ----------------------------
 # CONFIG
 # ----------------------------
-SOURCE_DIR = os.path.join(os.path.dirname(__file__), "filtered_data")   # contains images + .gt.txt
-OUTPUT_DIR = os.path.join(os.path.dirname(__file__), "boxed_data")      # output with images + .box
-os.makedirs(OUTPUT_DIR, exist_ok=True)
-
-VALID_EXTS = {".png", ".jpg", ".jpeg"}
+OUTPUT_DIR = BOXED_DIR      # output with images + .box
 
 # ----------------------------
 # MAIN
 # ----------------------------
-for fname in sorted(os.listdir(SOURCE_DIR)):
-    if not fname.endswith(".gt.txt"):
-        continue
-
-    base = fname[:-7]  # Remove .gt.txt
-    gt_path = os.path.join(SOURCE_DIR, fname)
-
-    # Read label
-    with open(gt_path, "r", encoding="utf-8", errors="ignore") as f:
-        text = f.read().strip().upper()
-    if not text:
-        print(f"Empty label in {fname}; skipping")
-        continue
-
-    # Find matching image
-    img_path = None
-    for ext in VALID_EXTS:
-        candidate = os.path.join(SOURCE_DIR, base + ext)
-        if os.path.exists(candidate):
-            img_path = candidate
-            break
-
-    if not img_path:
-        print(f"No image found for {fname}; skipping")
-        continue
-
-    # Get image size
-    with Image.open(img_path) as im:
-        w, h = im.size
-
-    # Write .box file
-    out_box = os.path.join(OUTPUT_DIR, f"{base}.box")
-    with open(out_box, "w", encoding="utf-8") as f:
-        f.write(f"{text} 0 0 {w} {h} 0\n")
-
-    # Copy image
-    out_img = os.path.join(OUTPUT_DIR, base + os.path.splitext(img_path)[1].lower())
-    shutil.copy2(img_path, out_img)
-
-    print(f"{os.path.basename(img_path)} + {fname} → {os.path.basename(out_box)}: '{text}' [{w}x{h}]")
-
-print(f"\nDone. Output written to: {OUTPUT_DIR}")
+def make_box_files(conn, output_dir=OUTPUT_DIR):
+    """
+    Write a .box file next to a hardlink of each valid crop.
+    Samples whose crop or label is unchanged since they were boxed are
+    skipped; samples that became invalid or were flagged as near-duplicates
+    have their box removed.
+    Returns the number of box files written.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+
+    # Drop outputs for samples that no longer pass validation or dedup
+    stale = conn.execute(
+        "SELECT id, path FROM samples "
+        "WHERE boxed IS NOT NULL AND (valid IS NOT 1 OR duplicate IS 1)"
+    ).fetchall()
+    for row in stale:
+        remove_box_files(row["id"], output_dir)
+        set_boxed(conn, row["id"], None)
+
+    pending = conn.execute(
+        """
+        SELECT id, path, sha1, label, x_min, y_min, x_max, y_max FROM samples
+        WHERE valid = 1 AND duplicate IS NOT 1
+          AND (boxed IS NULL OR boxed != sha1 || ':' || label)
+        ORDER BY id
+        """
+    ).fetchall()
+
+    written = 0
+    for row in pending:
+        text = row["label"].strip().upper()
+        img_path = abspath(row["path"])
+        if not os.path.exists(img_path):
+            print(f"No image found for {row['id']}; skipping")
+            continue
+
+        # Crop size is the bbox size, no need to open the image
+        w = row["x_max"] - row["x_min"]
+        h = row["y_max"] - row["y_min"]
+
+        # Write .box file
+        out_box = os.path.join(output_dir, f"{row['id']}.box")
+        with open(out_box, "w", encoding="utf-8") as f:
+            f.write(f"{text} 0 0 {w} {h} 0\n")
+
+        # Link image (no copy)
+        out_img = os.path.join(output_dir, row["id"] + os.path.splitext(img_path)[1].lower())
+        materialize(img_path, out_img)
+
+        set_boxed(conn, row["id"], f"{row['sha1']}:{row['label']}")
+        written += 1
+        print(f"{os.path.basename(img_path)} → {os.path.basename(out_box)}: '{text}' [{w}x{h}]")
+
+    conn.commit()
+    return written
+
+
+if __name__ == "__main__":
+    written = make_box_files(connect())
+    print(f"\nDone. {written} box files written to: {OUTPUT_DIR}")
@@ -0,0 +1,243 @@
+"""
+Dataset manifest shared by every fine-tuning stage.
+
+A single SQLite file records, per cropped plate: its source image and bbox,
+the crop's content hash, its transcription, whether it passed validation,
+its train/eval split and which version of it was last boxed. Stages read
+and update rows in place instead of re-scanning and copying directories,
+so each run only touches what changed since the last one.
+"""
+
+import hashlib
+import os
+import shutil
+import sqlite3
+
+# ----------------------------
+# CONFIG
+# ----------------------------
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DATASET_DIR = os.path.join(BASE_DIR, "dataset")
+MANIFEST_PATH = os.path.join(DATASET_DIR, "manifest.sqlite")
+BOXED_DIR = os.path.join(BASE_DIR, "boxed_data")  # .box files, .lstmf features and crop links
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path     TEXT PRIMARY KEY,
+    size     INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    sha1     TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS samples (
+    id     TEXT PRIMARY KEY,  -- crop name, e.g. 00000000_plate1
+    source TEXT NOT NULL,     -- source image, relative to BASE_DIR
+    source_sha1 TEXT,         -- content hash of the source image
+    x_min  INTEGER, y_min INTEGER, x_max INTEGER, y_max INTEGER,
+    path   TEXT,              -- crop file, relative to BASE_DIR
+    sha1   TEXT,              -- content hash of the crop
+    label  TEXT,              -- transcription, NULL until transcribed
+    valid  INTEGER,           -- 1/0 once checked, NULL while pending
+    split  TEXT,              -- 'train' / 'eval', NULL until assigned
+    boxed  TEXT,              -- sha1:label the .box file was written for
+    phash  INTEGER,           -- perceptual hash of the crop (see dedup.py)
+    phash_method TEXT,        -- hash function that produced it
+    cluster TEXT,             -- id of the near-duplicate cluster's representative
+    duplicate INTEGER         -- 1 when dropped as a near-duplicate
+);
+CREATE INDEX IF NOT EXISTS samples_source ON samples(source);
+CREATE INDEX IF NOT EXISTS samples_valid ON samples(valid);
+"""
+
+# Columns added after the first manifests were created: (name, declaration)
+_ADDED_COLUMNS = [
+    ("source_sha1", "TEXT"),
+    ("phash", "INTEGER"),
+    ("phash_method", "TEXT"),
+    ("cluster", "TEXT"),
+    ("duplicate", "INTEGER"),
+]
+
+# ----------------------------
+# CONNECTION + PATHS
+# ----------------------------
+def connect(path=MANIFEST_PATH):
+    """Open (and create if needed) the manifest database."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    conn = sqlite3.connect(path, timeout=30)  # stages may run in parallel
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.executescript(_SCHEMA)
+    columns = {row["name"] for row in conn.execute("PRAGMA table_info(samples)")}
+    for name, decl in _ADDED_COLUMNS:
+        if name not in columns:
+            conn.execute(f"ALTER TABLE samples ADD COLUMN {name} {decl}")
+    return conn
+
+
+def relpath(path):
+    """Path as stored in the manifest (relative to fine_tuning/)."""
+    return os.path.relpath(os.path.abspath(path), BASE_DIR)
+
+
+def abspath(path):
+    """Resolve a manifest path back to an absolute path."""
+    return os.path.join(BASE_DIR, path)
+
+# ----------------------------
+# CHANGE TRACKING
+# ----------------------------
+def file_sha1(path):
+    with open(path, "rb") as f:
+        return hashlib.file_digest(f, "sha1").hexdigest()
+
+
+def check_file(conn, path):
+    """
+    Compare a file with its recorded state, without recording anything.
+    Unchanged size and mtime are trusted without re-hashing the file.
+    Returns (changed, state): `changed` is True for new or modified files;
+    `state` is None when nothing needs recording, otherwise pass it to
+    record_file() once whatever depends on the file has been updated.
+    """
+    key = relpath(path)
+    st = os.stat(path)
+    row = conn.execute(
+        "SELECT size, mtime_ns, sha1 FROM files WHERE path = ?", (key,)
+    ).fetchone()
+    if row and row["size"] == st.st_size and row["mtime_ns"] == st.st_mtime_ns:
+        return False, None
+
+    sha1 = file_sha1(path)
+    return row is None or row["sha1"] != sha1, (key, st.st_size, st.st_mtime_ns, sha1)
+
+
+def record_file(conn, state):
+    """Store a state returned by check_file() (no-op for None)."""
+    if state is None:
+        return
+    conn.execute(
+        "INSERT INTO files (path, size, mtime_ns, sha1) VALUES (?, ?, ?, ?) "
+        "ON CONFLICT(path) DO UPDATE SET size = excluded.size, "
+        "mtime_ns = excluded.mtime_ns, sha1 = excluded.sha1",
+        state,
+    )
+
+
+def forget_file(conn, path):
+    """Drop a file's recorded state so the next refresh treats it as changed."""
+    conn.execute("DELETE FROM files WHERE path = ?", (relpath(path),))
+
+# ----------------------------
+# SAMPLE UPDATES
+# ----------------------------
+# True when an upserted crop covers the same pixels as the stored one
+_SAME_PIXELS = """(
+    samples.sha1 IS excluded.sha1 OR (
+        samples.source_sha1 IS excluded.source_sha1
+        AND samples.x_min = excluded.x_min AND samples.y_min = excluded.y_min
+        AND samples.x_max = excluded.x_max AND samples.y_max = excluded.y_max
+    )
+)"""
+
+
+def upsert_sample(conn, sample_id, source, bbox, path, sha1):
+    """
+    Insert or update a crop. A crop cut from different pixels (changed source
+    image or bbox) loses its label, validity and split, so downstream stages
+    redo it; re-encoding the same region keeps them.
+    """
+    x_min, y_min, x_max, y_max = bbox
+    source = relpath(source)
+    conn.execute(
+        f"""
+        INSERT INTO samples (id, source, source_sha1, x_min, y_min, x_max, y_max, path, sha1)
+        VALUES (?, ?, (SELECT sha1 FROM files WHERE path = ?), ?, ?, ?, ?, ?, ?)
+        ON CONFLICT(id) DO UPDATE SET
+            label = CASE WHEN {_SAME_PIXELS} THEN samples.label END,
+            valid = CASE WHEN {_SAME_PIXELS} THEN samples.valid END,
+            split = CASE WHEN {_SAME_PIXELS} THEN samples.split END,
+            phash = CASE WHEN samples.sha1 IS excluded.sha1 THEN samples.phash END,
+            source = excluded.source, source_sha1 = excluded.source_sha1,
+            x_min = excluded.x_min, y_min = excluded.y_min,
+            x_max = excluded.x_max, y_max = excluded.y_max,
+            path = excluded.path, sha1 = excluded.sha1
+        """,
+        (sample_id, source, source, x_min, y_min, x_max, y_max, relpath(path), sha1),
+    )
+
+
+def remove_samples(conn, sample_ids):
+    """Delete samples, and their box outputs so they are no longer trained on."""
+    for sample_id in sample_ids:
+        remove_box_files(sample_id)
+    conn.executemany("DELETE FROM samples WHERE id = ?", [(i,) for i in sample_ids])
+
+
+def remove_box_files(sample_id, boxed_dir=BOXED_DIR):
+    """Delete a sample's .box, .lstmf and crop link from the boxed data directory."""
+    for suffix in (".box", ".lstmf", ".png", ".jpg", ".jpeg"):
+        path = os.path.join(boxed_dir, sample_id + suffix)
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def set_label(conn, sample_id, label):
+    """Store a transcription; validity is reset so it gets re-checked."""
+    conn.execute(
+        "UPDATE samples SET label = ?, valid = NULL WHERE id = ?",
+        (label, sample_id),
+    )
+
+
+def set_valid(conn, sample_id, valid):
+    conn.execute("UPDATE samples SET valid = ? WHERE id = ?", (int(valid), sample_id))
+
+
+def set_split(conn, sample_id, split):
+    conn.execute("UPDATE samples SET split = ? WHERE id = ?", (split, sample_id))
+
+
+def set_boxed(conn, sample_id, stamp):
+    conn.execute("UPDATE samples SET boxed = ? WHERE id = ?", (stamp, sample_id))
+
+
+def import_labels(conn, gt_dir):
+    """
+    Adopt existing `<id>.gt.txt` transcriptions for samples that have no
+    label yet, so data transcribed before the manifest existed is kept.
+    Returns the number of labels imported.
+    """
+    if not os.path.isdir(gt_dir):
+        return 0
+
+    pending = {
+        row["id"] for row in conn.execute("SELECT id FROM samples WHERE label IS NULL")
+    }
+    imported = 0
+    for sample_id in pending:
+        gt_path = os.path.join(gt_dir, sample_id + ".gt.txt")
+        if not os.path.exists(gt_path):
+            continue
+        with open(gt_path, "r", encoding="utf-8", errors="ignore") as f:
+            set_label(conn, sample_id, f.read().strip().upper())
+        imported += 1
+    conn.commit()
+    return imported
+
+# ----------------------------
+# MATERIALIZATION
+# ----------------------------
+def materialize(src, dst):
+    """
+    Make `dst` refer to the same content as `src` without duplicating it:
+    a hardlink where possible, a copy only across filesystems.
+    """
+    if os.path.exists(dst):
+        if os.path.samefile(src, dst):
+            return
+        os.remove(dst)
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
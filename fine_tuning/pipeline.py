@@ -0,0 +1,455 @@
+"""
+Incremental runner for the whole fine-tuning flow.
+
+Stages declare their dependencies, a fingerprint of their inputs and the
+output paths they produce. A stage is skipped when its input fingerprint
+matches the one recorded after its last complete run and its outputs
+still exist; otherwise it runs (and, thanks to the manifest, only processes
+what changed). A stage that can stop with work left (transcription out of
+quota, images that failed to crop) reports it, and then stays dirty until a
+run finishes everything. Files are fingerprinted by content, so rewriting
+one unchanged does not retrigger its consumers; listfiles also cover the
+content of the features they list, so relabelled samples are retrained on. Stages whose dependencies
+are satisfied run in parallel, and every run ends with a per-stage timing
+report.
+
+Usage:
+    python -m fine_tuning run [--jobs N] [--until STAGE] [--force STAGE ...] [--skip STAGE ...]
+    python -m fine_tuning stages
+"""
+
+import argparse
+import hashlib
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from .manifest import connect, file_sha1
+
+_CACHE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS stage_cache (
+    stage       TEXT PRIMARY KEY,
+    fingerprint TEXT NOT NULL,
+    finished_at REAL NOT NULL,
+    seconds     REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS file_hashes (
+    path     TEXT PRIMARY KEY,
+    size     INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    sha1     TEXT NOT NULL
+);
+"""
+
+# ----------------------------
+# FINGERPRINT HELPERS
+# ----------------------------
+def _rows(conn, query):
+    """Hash the result of a manifest query."""
+    h = hashlib.sha1()
+    for row in conn.execute(query):
+        h.update(repr(tuple(row)).encode())
+    return h.hexdigest()
+
+
+def _content(conn, path, st=None):
+    """
+    SHA-1 of a file's content, cached by path; an unchanged size and mtime
+    are trusted without re-reading the file.
+    """
+    st = st or os.stat(path)
+    key = os.path.abspath(path)
+    row = conn.execute(
+        "SELECT size, mtime_ns, sha1 FROM file_hashes WHERE path = ?", (key,)
+    ).fetchone()
+    if row and row["size"] == st.st_size and row["mtime_ns"] == st.st_mtime_ns:
+        return row["sha1"]
+    sha1 = file_sha1(path)
+    conn.execute(
+        "INSERT INTO file_hashes (path, size, mtime_ns, sha1) VALUES (?, ?, ?, ?) "
+        "ON CONFLICT(path) DO UPDATE SET size = excluded.size, "
+        "mtime_ns = excluded.mtime_ns, sha1 = excluded.sha1",
+        (key, st.st_size, st.st_mtime_ns, sha1),
+    )
+    return sha1
+
+
+def _dir(conn, path):
+    """Hash the names and contents of a directory's files."""
+    h = hashlib.sha1()
+    if os.path.isdir(path):
+        for entry in sorted(os.scandir(path), key=lambda e: e.name):
+            if entry.is_file():
+                h.update(f"{entry.name}:{_content(conn, entry.path, entry.stat())}\n".encode())
+    conn.commit()
+    return h.hexdigest()
+
+
+def _file(conn, path):
+    if not os.path.exists(path):
+        return "missing"
+    sha1 = _content(conn, path)
+    conn.commit()
+    return sha1
+
+
+def _listed(conn, listfile):
+    """
+    Hash a listfile together with the content of every file it lists, so
+    features regenerated for a relabelled sample change it even though the
+    listed paths do not.
+    """
+    if not os.path.exists(listfile):
+        return "missing"
+    h = hashlib.sha1()
+    with open(listfile, "r") as f:
+        for line in f:
+            path = line.strip()
+            if path:
+                sha1 = _content(conn, path) if os.path.exists(path) else "missing"
+                h.update(f"{path}:{sha1}\n".encode())
+    conn.commit()
+    return h.hexdigest()
+
+# ----------------------------
+# STAGES
+# ----------------------------
+class Stage:
+    """
+    A pipeline step. `run(args)` does the work; `inputs(args, conn)` returns
+    the parts of its fingerprint; `outputs(args)` lists paths it must leave;
+    `left(args, conn)` counts work a run did not get through, if it can stop
+    partway.
+    """
+
+    def __init__(self, name, run, inputs, deps=(), outputs=None, left=None):
+        self.name = name
+        self.run = run
+        self.inputs = inputs
+        self.deps = tuple(deps)
+        self.outputs = outputs or (lambda args: [])
+        self.left = left or (lambda args, conn: 0)
+
+    def fingerprint(self, args, conn):
+        h = hashlib.sha1()
+        for part in self.inputs(args, conn):
+            h.update(str(part).encode() + b"\0")
+        return h.hexdigest()
+
+
+def _crop_left(args, conn):
+    """Labelled images with no recorded state: new, or dropped after a failed crop."""
+    from .crop_plates import VALID_EXTS
+    from .manifest import relpath
+
+    known = {row["path"] for row in conn.execute("SELECT path FROM files")}
+    left = 0
+    if os.path.isdir(args.images):
+        for entry in os.scandir(args.images):
+            stem, ext = os.path.splitext(entry.name)
+            label = os.path.join(args.labels, stem + ".txt")
+            if ext.lower() in VALID_EXTS and os.path.exists(label):
+                left += relpath(entry.path) not in known or relpath(label) not in known
+    return left
+
+
+def _run_crop(args):
+    from .crop_plates import crop_plates
+    crop_plates(args.images, args.labels, fmt=args.format, workers=args.workers)
+
+
+def _run_dedup(args):
+    from .dedup import dedup
+    dedup(connect(), max_distance=args.max_distance)
+
+
+def _run_transcribe(args):
+    import asyncio
+
+    from dotenv import load_dotenv
+
+    from .gemini_api_transcriber import LEGACY_GT_DIR, GeminiBackend, HTTPBackend, transcribe_pending
+    from .manifest import import_labels
+
+    conn = connect()
+    import_labels(conn, LEGACY_GT_DIR)
+    if args.transcriber_url:
+        backend = HTTPBackend(args.transcriber_url)
+    else:
+        load_dotenv()
+        api_key = os.getenv("GEMINI_API_KEY_4")
+        if not api_key:
+            raise ValueError("GEMINI_API_KEY not found in environment variables.")
+        backend = GeminiBackend(api_key)
+    asyncio.run(transcribe_pending(conn, backend))
+
+
+def _run_filter(args):
+    from .filter_valid_plates import filter_plates
+    filter_plates(connect())
+
+
+def _run_box(args):
+    from .make_box_files import make_box_files
+    make_box_files(connect())
+
+
+def _run_pack(args):
+    from .shards import pack
+    pack(connect())
+
+
+def _run_extract(args):
+    from .train_split import extract_lstm
+    extract_lstm()
+
+
+def _run_lstmf(args):
+    from .train_split import generate_lstmf
+    generate_lstmf()
+
+
+def _run_split(args):
+    from .train_split import collect_lstmf_files, split_and_write_listfiles
+    split_and_write_listfiles(collect_lstmf_files())
+
+
+def _run_train(args):
+    from .train_split import OUTPUT_DIR, finalize_model, run_training
+    run_training(os.path.join(OUTPUT_DIR, "eng.lstm"), os.path.join(OUTPUT_DIR, "train_listfile.txt"))
+    finalize_model()
+
+
+def _run_eval_default(args):
+    from .train_split import OUTPUT_DIR, evaluate_default_model
+    acc = evaluate_default_model(
+        os.path.join(OUTPUT_DIR, "eval_listfile.txt"),
+        os.path.join(OUTPUT_DIR, "accuracy_default.txt"),
+    )
+    print(f"non fine tuned: {_fmt_acc(acc)}")
+
+
+def _run_eval_finetuned(args):
+    from .train_split import MODELS_DIR, OUTPUT_DIR, evaluate_finetuned_model
+    acc = evaluate_finetuned_model(
+        os.path.join(OUTPUT_DIR, "eval_listfile.txt"),
+        os.path.join(MODELS_DIR, "plates.traineddata"),
+    )
+    print(f"fine tuned: {_fmt_acc(acc)}")
+
+
+def _fmt_acc(a):
+    return "could not compute accuracy" if a is None else f"{a * 100:.2f}%"
+
+
+def build_stages():
+    # Imported here: train_split creates its output directories on import
+    from . import make_box_files, shards
+    from . import train_split as ts
+    from .gemini_api_transcriber import PENDING_QUERY
+
+    out = ts.OUTPUT_DIR
+    listfiles = [os.path.join(out, "train_listfile.txt"), os.path.join(out, "eval_listfile.txt")]
+    final_model = os.path.join(ts.MODELS_DIR, "plates.traineddata")
+
+    return [
+        Stage("crop", _run_crop,
+              lambda a, c: [_dir(c, a.images), _dir(c, a.labels), a.format],
+              left=_crop_left),
+        Stage("dedup", _run_dedup,
+              lambda a, c: [_rows(c, "SELECT id, sha1, valid FROM samples ORDER BY id"), a.max_distance],
+              deps=["crop"]),
+        Stage("transcribe", _run_transcribe,
+              lambda a, c: [_rows(c, "SELECT id, sha1 FROM samples WHERE label IS NULL "
+                                     "AND duplicate IS NOT 1 ORDER BY id")],
+              deps=["dedup"],
+              left=lambda a, c: len(c.execute(PENDING_QUERY).fetchall())),
+        Stage("filter", _run_filter,
+              lambda a, c: [_rows(c, "SELECT id, label, valid FROM samples ORDER BY id")],
+              deps=["transcribe"]),
+        Stage("box", _run_box,
+              lambda a, c: [_rows(c, "SELECT id, sha1, label, valid, duplicate, boxed "
+                                     "FROM samples ORDER BY id")],
+              deps=["filter"],
+              outputs=lambda a: [make_box_files.OUTPUT_DIR]),
+        Stage("pack", _run_pack,
+              lambda a, c: [_rows(c, "SELECT id, sha1, label FROM samples "
+                                     "WHERE valid = 1 AND duplicate IS NOT 1 ORDER BY id")],
+              deps=["filter"],
+              outputs=lambda a: [shards.SHARD_PATH, shards.index_path(shards.SHARD_PATH)]),
+        Stage("extract_lstm", _run_extract,
+              lambda a, c: [_file(c, ts.TRAINEDDATA)],
+              outputs=lambda a: [os.path.join(out, "eng.lstm")]),
+        Stage("lstmf", _run_lstmf,
+              lambda a, c: [_rows(c, "SELECT id, boxed FROM samples "
+                                     "WHERE boxed IS NOT NULL ORDER BY id")],
+              deps=["box"]),
+        Stage("split", _run_split,
+              lambda a, c: [_rows(c, "SELECT id, boxed, cluster, split FROM samples "
+                                     "WHERE boxed IS NOT NULL ORDER BY id")],
+              deps=["lstmf"],
+              outputs=lambda a: listfiles),
+        Stage("train", _run_train,
+              lambda a, c: [_listed(c, listfiles[0]), _file(c, os.path.join(out, "eng.lstm")),
+                            ts.MAX_ITER],
+              deps=["extract_lstm", "split"],
+              outputs=lambda a: [final_model]),
+        Stage("eval_default", _run_eval_default,
+              lambda a, c: [_listed(c, listfiles[1]), _file(c, ts.TRAINEDDATA)],
+              deps=["split"]),
+        Stage("eval_finetuned", _run_eval_finetuned,
+              lambda a, c: [_listed(c, listfiles[1]), _file(c, final_model)],
+              deps=["train"]),
+    ]
+
+# ----------------------------
+# RUNNER
+# ----------------------------
+def _run_stage(stage, args, force):
+    """
+    Run one stage unless cached; returns (status, seconds). The status is
+    "partial" when the stage left work undone, which keeps it uncached.
+    """
+    conn = connect()
+    conn.executescript(_CACHE_SCHEMA)
+    before = stage.fingerprint(args, conn)
+    cached = conn.execute(
+        "SELECT fingerprint FROM stage_cache WHERE stage = ?", (stage.name,)
+    ).fetchone()
+    outputs_ok = all(os.path.exists(p) for p in stage.outputs(args))
+    if not force and outputs_ok and cached and cached["fingerprint"] == before:
+        return "cached", 0.0
+
+    start = time.perf_counter()
+    stage.run(args)
+    seconds = time.perf_counter() - start
+
+    left = stage.left(args, conn)
+    if left:
+        print(f"{stage.name}: {left} left to do, will run again")
+        conn.execute("DELETE FROM stage_cache WHERE stage = ?", (stage.name,))
+        conn.commit()
+        return "partial", seconds
+
+    # Record the post-run state, so stages that update their own inputs
+    # (e.g. transcribe filling labels) are cached on the next run
+    after = stage.fingerprint(args, conn)
+    conn.execute(
+        "INSERT INTO stage_cache (stage, fingerprint, finished_at, seconds) VALUES (?, ?, ?, ?) "
+        "ON CONFLICT(stage) DO UPDATE SET fingerprint = excluded.fingerprint, "
+        "finished_at = excluded.finished_at, seconds = excluded.seconds",
+        (stage.name, after, time.time(), seconds),
+    )
+    conn.commit()
+    return "ran", seconds
+
+
+def _select(stages, until):
+    """`until` and everything it depends on."""
+    by_name = {s.name: s for s in stages}
+    keep, todo = set(), [until]
+    while todo:
+        name = todo.pop()
+        if name not in keep:
+            keep.add(name)
+            todo.extend(by_name[name].deps)
+    return [s for s in stages if s.name in keep]
+
+
+def run_pipeline(stages, args, jobs=2, force=(), skip=()):
+    """
+    Run stages in dependency order, independent ones in parallel.
+    Returns {stage: (status, seconds)}.
+    """
+    pending = {s.name: s for s in stages}
+    report, done, failed = {}, set(), set()
+
+    with ThreadPoolExecutor(jobs) as pool:
+        running = {}
+        while pending or running:
+            scheduled = True
+            while scheduled:
+                scheduled = False
+                for name, stage in list(pending.items()):
+                    if any(d in failed for d in stage.deps):
+                        failed.add(name)
+                        report[name] = ("blocked", 0.0)
+                    elif all(d in done for d in stage.deps):
+                        if name in skip:
+                            # Skipped stages still wait for their dependencies
+                            done.add(name)
+                            report[name] = ("skipped", 0.0)
+                        else:
+                            print(f"==> {name}")
+                            running[pool.submit(_run_stage, stage, args, name in force)] = name
+                    else:
+                        continue
+                    del pending[name]
+                    scheduled = True
+
+            if not running:
+                break
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                name = running.pop(future)
+                try:
+                    report[name] = future.result()
+                    done.add(name)
+                except Exception as e:
+                    print(f"Stage {name} failed: {e}")
+                    report[name] = ("failed", 0.0)
+                    failed.add(name)
+
+    return report
+
+
+def print_report(stages, report):
+    print("\n" + ("-" * 40))
+    for stage in stages:
+        status, seconds = report.get(stage.name, ("not run", 0.0))
+        print(f"{stage.name:<16} {status:<8} {seconds:8.1f}s")
+    print("-" * 40)
+
+
+def main():
+    from .crop_plates import DEFAULT_FORMAT, FORMATS, IMAGES_DIR, LABELS_DIR
+    from .dedup import MAX_DISTANCE
+
+    parser = argparse.ArgumentParser(prog="python -m fine_tuning",
+                                     description="Run the fine-tuning pipeline.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("stages", help="list stages and their dependencies")
+
+    run = sub.add_parser("run", help="run stages whose inputs changed")
+    run.add_argument("--jobs", type=int, default=2, help="stages to run in parallel")
+    run.add_argument("--until", help="run only this stage and its dependencies")
+    run.add_argument("--force", nargs="+", default=[], metavar="STAGE", help="ignore the cache")
+    run.add_argument("--skip", nargs="+", default=[], metavar="STAGE",
+                     help="treat as done, e.g. transcribe when the API quota is spent")
+    run.add_argument("--images", default=IMAGES_DIR)
+    run.add_argument("--labels", default=LABELS_DIR)
+    run.add_argument("--format", choices=sorted(FORMATS), default=DEFAULT_FORMAT)
+    run.add_argument("--workers", type=int, default=None, help="crop processes")
+    run.add_argument("--max-distance", type=int, default=MAX_DISTANCE, help="dedup threshold")
+    run.add_argument("--transcriber-url", help="use an HTTP transcription backend")
+    args = parser.parse_args()
+
+    stages = build_stages()
+    names = [s.name for s in stages]
+    if args.command == "stages":
+        for s in stages:
+            print(f"{s.name:<16} <- {', '.join(s.deps) or '-'}")
+        return
+
+    for name in [args.until, *args.force, *args.skip]:
+        if name and name not in names:
+            parser.error(f"unknown stage '{name}' (choose from {', '.join(names)})")
+    if args.until:
+        stages = _select(stages, args.until)
+
+    start = time.perf_counter()
+    report = run_pipeline(stages, args, args.jobs, set(args.force), set(args.skip))
+    print_report(stages, report)
+    print(f"Total: {time.perf_counter() - start:.1f}s")
+    if any(status in ("failed", "blocked") for status, _ in report.values()):
+        raise SystemExit(1)
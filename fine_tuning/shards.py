@@ -0,0 +1,151 @@
+"""
+Pack cropped plates into a single shard file for fast random access.
+
+The shard is the concatenation of the encoded crop files; a JSON sidecar
+(`<shard>.idx`) maps each sample id to its byte offset, length, content
+hash and label. Readers memory-map the shard, so eval scripts and
+benchmarks can fetch any crop without touching thousands of small files.
+
+Usage:
+    python -m fine_tuning.shards [shard_path]
+"""
+
+import json
+import mmap
+import os
+import sys
+
+from .manifest import DATASET_DIR, abspath, connect
+
+# ----------------------------
+# CONFIG
+# ----------------------------
+SHARD_PATH = os.path.join(DATASET_DIR, "crops.shard")
+COMPACT_RATIO = 0.5         # rewrite the shard once this fraction of it is dead bytes
+
+
+def index_path(shard_path):
+    return shard_path + ".idx"
+
+
+def _load_index(shard_path):
+    path = index_path(shard_path)
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+# ----------------------------
+# PACKER
+# ----------------------------
+def pack(conn, shard_path=SHARD_PATH, only_valid=True):
+    """
+    Bring the shard in line with the manifest. The index is rebuilt from
+    the current samples, so removed, invalid and duplicate crops drop out;
+    unchanged crops keep their offsets and new or changed ones are
+    appended. Once more than COMPACT_RATIO of the shard is bytes no longer
+    indexed, it is rewritten with only the live crops.
+    Returns the number of crops written.
+    """
+    old = _load_index(shard_path)
+    query = "SELECT id, path, sha1, label FROM samples WHERE path IS NOT NULL"
+    if only_valid:
+        query += " AND valid = 1 AND duplicate IS NOT 1"
+
+    kept, new = {}, []
+    for row in conn.execute(query):
+        entry = old.get(row["id"])
+        if entry and entry["sha1"] == row["sha1"]:
+            kept[row["id"]] = dict(entry, label=row["label"])
+        else:
+            new.append(row)
+
+    size = os.path.getsize(shard_path) if os.path.exists(shard_path) else 0
+    dead = size - sum(e["length"] for e in kept.values())
+    compact = size and dead > size * COMPACT_RATIO
+
+    index = {}
+    out_path = shard_path + ".tmp" if compact else shard_path
+    with open(out_path, "wb" if compact else "ab") as shard:
+        offset = shard.tell()
+
+        def append(sample_id, data, sha1, label):
+            nonlocal offset
+            shard.write(data)
+            index[sample_id] = {"offset": offset, "length": len(data), "sha1": sha1, "label": label}
+            offset += len(data)
+
+        if compact:
+            with open(shard_path, "rb") as src:
+                for sample_id, entry in sorted(kept.items(), key=lambda kv: kv[1]["offset"]):
+                    src.seek(entry["offset"])
+                    append(sample_id, src.read(entry["length"]), entry["sha1"], entry["label"])
+        else:
+            index.update(kept)
+
+        for row in new:
+            with open(abspath(row["path"]), "rb") as f:
+                append(row["id"], f.read(), row["sha1"], row["label"])
+
+    if compact:
+        os.replace(out_path, shard_path)
+        print(f"Compacted {shard_path}, reclaiming {dead} bytes.")
+    tmp = index_path(shard_path) + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(index, f)
+    os.replace(tmp, index_path(shard_path))
+    return len(new)
+
+# ----------------------------
+# READER
+# ----------------------------
+class ShardReader:
+    """Memory-mapped random access to a packed shard."""
+
+    def __init__(self, shard_path=SHARD_PATH):
+        self.index = _load_index(shard_path)
+        self._file = open(shard_path, "rb")
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, sample_id):
+        return sample_id in self.index
+
+    def ids(self):
+        return list(self.index)
+
+    def label(self, sample_id):
+        return self.index[sample_id]["label"]
+
+    def read(self, sample_id):
+        """Encoded bytes of a crop, as a zero-copy memoryview."""
+        entry = self.index[sample_id]
+        start = entry["offset"]
+        return memoryview(self._mmap)[start:start + entry["length"]]
+
+    def image(self, sample_id, flags=None):
+        """Decoded crop as a BGR ndarray."""
+        import cv2
+        import numpy as np
+
+        buf = np.frombuffer(self.read(sample_id), np.uint8)
+        return cv2.imdecode(buf, cv2.IMREAD_COLOR if flags is None else flags)
+
+    def close(self):
+        self._mmap.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+if __name__ == "__main__":
+    shard_path = sys.argv[1] if len(sys.argv) > 1 else SHARD_PATH
+    conn = connect()
+    written = pack(conn, shard_path)
+    print(f"Packed {written} new crops into {shard_path}")
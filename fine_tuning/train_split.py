@@ -1,8 +1,10 @@
+import hashlib
 import os
 import subprocess
-import random
 import re
 
+from .manifest import connect, set_split
+
 # ----------------------------
 # CONFIG
 # ----------------------------
@@ -47,8 +49,13 @@ def generate_lstmf():
         img_path = os.path.join(FILTERED_DIR, img_name)
         base = os.path.splitext(img_name)[0]
         lstmf_file = os.path.join(FILTERED_DIR, f"{base}.lstmf")
+        box_file = os.path.join(FILTERED_DIR, f"{base}.box")
 
-        if os.path.exists(lstmf_file):
+        # Up to date unless the box (label) was rewritten after the features
+        if os.path.exists(lstmf_file) and (
+            not os.path.exists(box_file)
+            or os.path.getmtime(lstmf_file) >= os.path.getmtime(box_file)
+        ):
             continue
 
         print(f"Generating LSTM features for {img_name}...")
@@ -71,14 +78,45 @@ def collect_lstmf_files():
         raise RuntimeError("No .lstmf files found — check your data.")
     return files
 
-def split_and_write_listfiles(files, train_ratio=TRAIN_RATIO, seed=RANDOM_SEED):
-    random.seed(seed)
-    shuffled = files[:]
-    random.shuffle(shuffled)
-    split_idx = int(len(shuffled) * train_ratio)
+def _assign_split(sample_id, train_ratio, seed):
+    """Deterministic per-sample split, independent of the rest of the dataset."""
+    digest = hashlib.sha1(f"{seed}:{sample_id}".encode()).digest()
+    return "train" if int.from_bytes(digest[:8], "big") / 2**64 < train_ratio else "eval"
 
-    train_files = shuffled[:split_idx]
-    eval_files = shuffled[split_idx:]
+def split_and_write_listfiles(files, train_ratio=TRAIN_RATIO, seed=RANDOM_SEED):
+    """
+    Split .lstmf files into train/eval. Splits are stored in the manifest, so
+    adding data never moves existing samples. New samples take the split of
+    their near-duplicate cluster (see dedup.py), so similar frames stay on one
+    side; only clusters that merge after both were split can straddle it.
+    """
+    conn = connect()
+    rows = {
+        row["id"]: row
+        for row in conn.execute(
+            "SELECT id, split, COALESCE(cluster, id) AS cluster FROM samples ORDER BY id")
+    }
+
+    # New members of a cluster join the split of its first member that has one
+    cluster_split = {}
+    for row in rows.values():
+        if row["split"] is not None:
+            cluster_split.setdefault(row["cluster"], row["split"])
+
+    train_files, eval_files = [], []
+    for path in files:
+        sample_id = os.path.splitext(os.path.basename(path))[0]
+        row = rows.get(sample_id)
+        key = row["cluster"] if row else sample_id
+        split = row["split"] if row else None
+        if split is None:
+            split = cluster_split.get(key)
+        if split is None:
+            split = cluster_split[key] = _assign_split(key, train_ratio, seed)
+        if row and row["split"] is None:
+            set_split(conn, sample_id, split)
+        (train_files if split == "train" else eval_files).append(path)
+    conn.commit()
 
     train_listfile = os.path.join(OUTPUT_DIR, "train_listfile.txt")
     eval_listfile = os.path.join(OUTPUT_DIR, "eval_listfile.txt")
@@ -147,10 +185,10 @@ def finalize_model():
 # ----------------------------
 # STEP 6: Evaluate with lstmeval and print accuracy
 # ----------------------------
-def evaluate_model(model_path, eval_listfile):
+def evaluate_model(model_path, eval_listfile, accuracy_file=None):
     """
     Run lstmeval, capture output, parse many possible metrics, and return accuracy (0..1) or None.
-    Writes output/accuracy.txt with percentage if parsed.
+    Writes output/accuracy.txt (or accuracy_file) with percentage if parsed.
     """
     if not eval_listfile or not os.path.exists(eval_listfile):
         print("No eval listfile found; skipping evaluation.")
@@ -186,7 +224,7 @@ def evaluate_model(model_path, eval_listfile):
             print(f"\nParsed BCER eval = {bcer} -> Accuracy = {accuracy * 100:.2f}%")
             # write to file
             try:
-                acc_file = os.path.join(OUTPUT_DIR, "accuracy.txt")
+                acc_file = accuracy_file or os.path.join(OUTPUT_DIR, "accuracy.txt")
                 with open(acc_file, "w") as f:
                     f.write(f"{accuracy * 100:.4f}%\n")
                 print(f"Wrote accuracy to {acc_file}")
@@ -204,7 +242,7 @@ def evaluate_model(model_path, eval_listfile):
             accuracy = max(0.0, min(1.0, (100.0 - bwer) / 100.0))
             print(f"\nParsed BWER eval = {bwer} -> Word-level Accuracy ≈ {accuracy * 100:.2f}%")
             try:
-                acc_file = os.path.join(OUTPUT_DIR, "accuracy.txt")
+                acc_file = accuracy_file or os.path.join(OUTPUT_DIR, "accuracy.txt")
                 with open(acc_file, "w") as f:
                     f.write(f"word_accuracy:{accuracy * 100:.4f}%\n")
                 print(f"Wrote accuracy to {acc_file}")
@@ -232,7 +270,7 @@ def evaluate_model(model_path, eval_listfile):
                 if 0.0 <= acc <= 1.0:
                     print(f"\nParsed metric via pattern '{pat}' -> Accuracy = {acc*100:.2f}%")
                     try:
-                        acc_file = os.path.join(OUTPUT_DIR, "accuracy.txt")
+                        acc_file = accuracy_file or os.path.join(OUTPUT_DIR, "accuracy.txt")
                         with open(acc_file, "w") as f:
                             f.write(f"{acc * 100:.4f}%\n")
                         print(f"Wrote accuracy to {acc_file}")
@@ -252,7 +290,7 @@ def evaluate_model(model_path, eval_listfile):
             accuracy = max(0.0, 1.0 - err)
             print(f"\nParsed error rate = {err} -> Accuracy = {accuracy*100:.2f}%")
             try:
-                acc_file = os.path.join(OUTPUT_DIR, "accuracy.txt")
+                acc_file = accuracy_file or os.path.join(OUTPUT_DIR, "accuracy.txt")
                 with open(acc_file, "w") as f:
                     f.write(f"{accuracy * 100:.4f}%\n")
                 print(f"Wrote accuracy to {acc_file}")
@@ -268,16 +306,16 @@ def evaluate_model(model_path, eval_listfile):
 # ----------------------------
 # EXTRA: Compare default vs fine-tuned model
 # ----------------------------
-def evaluate_default_model(eval_listfile):
+def evaluate_default_model(eval_listfile, accuracy_file=None):
     """Evaluate the default Tesseract model (TRAINEDDATA) on eval_listfile."""
     default_model = TRAINEDDATA  # path to eng_best.traineddata
     print("\nEvaluating DEFAULT Tesseract English model...")
-    return evaluate_model(default_model, eval_listfile)
+    return evaluate_model(default_model, eval_listfile, accuracy_file)
 
-def evaluate_finetuned_model(eval_listfile, finetuned_path):
+def evaluate_finetuned_model(eval_listfile, finetuned_path, accuracy_file=None):
     """Evaluate the fine-tuned model at finetuned_path on eval_listfile."""
     print("\nEvaluating FINE-TUNED model...")
-    return evaluate_model(finetuned_path, eval_listfile)
+    return evaluate_model(finetuned_path, eval_listfile, accuracy_file)
 
 # ----------------------------
 # MAIN
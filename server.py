@@ -1,55 +1,508 @@
-from fastapi import FastAPI, Request
-from fastapi.responses import JSONResponse
+import asyncio
+import hmac
+import json
+import os
+import time
+from contextlib import asynccontextmanager
+
+from fastapi import FastAPI, Header, Query, Request, WebSocket
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, StreamingResponse
 from pydantic import BaseModel
-from anpr import detect_and_ocr
+from anpr import recognize_plate
 from anpr import detect_vehicle
+from anpr.coalesce import SingleFlight, content_key
+from anpr.detect import Tiling, load_image
+from anpr.jobs import JobQueue
+from anpr.registry import KINDS, ModelRegistry
+from anpr.roi import CameraProfiles
+from anpr.sightings import MATCHES, SightingStore
+from anpr.watchlist import Watchlist
+from anpr.scheduler import QUALITY_LEVELS, Priority, Scheduler
+
+# Bulk jobs: durable queue location and how many images are processed at once
+JOBS_DB = os.environ.get("ANPR_JOBS_DB", "jobs.sqlite")
+JOB_WORKERS = int(os.environ.get("ANPR_JOB_WORKERS", "1"))
+JOB_STREAM_POLL = 0.5  # seconds between NDJSON progress checks
+# Seconds an NDJSON stream waits without a new result before giving up
+JOB_STREAM_TIMEOUT = float(os.environ.get("ANPR_JOB_STREAM_TIMEOUT", "300"))
+
+# Recognition threads shared by live requests and bulk jobs
+RECOGNIZE_WORKERS = int(os.environ.get("ANPR_WORKERS", "2"))
+# Priority of /api/detect requests that send no X-Priority header
+DEFAULT_PRIORITY = os.environ.get("ANPR_DEFAULT_PRIORITY", "high")
+
+# Seconds between checks of the model files for new versions (0 disables)
+MODEL_WATCH = float(os.environ.get("ANPR_MODEL_WATCH", "5"))
+# Declared per-camera regions of interest (see anpr/roi.py)
+CAMERAS_FILE = os.environ.get("ANPR_CAMERAS", "cameras.json")
+# Undeclared cameras whose ROI is learned at once; the least recently seen is dropped
+MAX_LEARNED_CAMERAS = int(os.environ.get("ANPR_MAX_LEARNED_CAMERAS", "256"))
+# Tiled detection: tile size in px (unset: off) and the frame size it starts at, in megapixels
+TILING = Tiling(
+    size=int(os.environ["ANPR_TILE_SIZE"]),
+    min_pixels=int(float(os.environ.get("ANPR_TILE_ABOVE_MP", "8")) * 1e6),
+) if os.environ.get("ANPR_TILE_SIZE") else None
+# Watchlist indexes checked on request, as "name=path,name=path" (see anpr/watchlist.py)
+WATCHLISTS = dict(item.split("=", 1) for item in os.environ.get("ANPR_WATCHLISTS", "").split(",")
+                  if item)
+# Live requests waiting for a recognition thread beyond which /api/detect answers 429 (0: no limit)
+MAX_QUEUE = int(os.environ.get("ANPR_MAX_QUEUE", "0"))
+# Seconds during which a camera stream doesn't repeat an event for the same plate
+STREAM_REPEAT = float(os.environ.get("ANPR_STREAM_REPEAT", "10"))
+# Type vehicles from the plate's shape when it is unambiguous, skipping the classifier
+VEHICLE_FROM_PLATE = os.environ.get("ANPR_VEHICLE_FROM_PLATE", "0") == "1"
+# SQLite file every live read is recorded in, for /api/sightings (unset: off)
+SIGHTINGS_DB = os.environ.get("ANPR_SIGHTINGS_DB")
+SIGHTINGS_MAX_LIMIT = 1000  # rows one /api/sightings query may return
+# Required in X-Admin-Token for /api/admin/*; the admin API is off when unset
+ADMIN_TOKEN = os.environ.get("ANPR_ADMIN_TOKEN")
+
+
+@asynccontextmanager
+async def lifespan(app):
+    app.state.models = ModelRegistry()
+    await run_in_threadpool(app.state.models.start, MODEL_WATCH)
+    app.state.cameras = CameraProfiles.load(CAMERAS_FILE, MAX_LEARNED_CAMERAS)
+    app.state.watchlists = {name: Watchlist.open(path) for name, path in WATCHLISTS.items()}
+    app.state.scheduler = Scheduler(RECOGNIZE_WORKERS)
+    app.state.scheduler.start()
+    app.state.flights = SingleFlight()
+    app.state.sightings = SightingStore(SIGHTINGS_DB) if SIGHTINGS_DB else None
+    app.state.jobs = JobQueue(JOBS_DB)
+    app.state.jobs_ready = asyncio.Event()
+    requeued = app.state.jobs.recover()
+    if requeued:
+        print(f"Requeued {requeued} job items interrupted by the last shutdown.")
+    workers = [asyncio.create_task(_job_worker(app)) for _ in range(JOB_WORKERS)]
+    yield
+    for w in workers:
+        w.cancel()
+    await asyncio.gather(*workers, return_exceptions=True)
+    await app.state.scheduler.stop()
+    app.state.models.close()
+    app.state.jobs.close()
+    if app.state.sightings is not None:
+        await run_in_threadpool(app.state.sightings.close)
+
+
 app = FastAPI(
     title="ANPR API",
     description="Automatic Number Plate Recognition API",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 
 class ImageRequest(BaseModel):
     image_base64: str
+    camera_id: str | None = None
+    watchlist: bool = False
+
+
+class JobRequest(BaseModel):
+    images: list[str]
+    priority: int = 0  # among jobs: higher is processed first
+
+
+class ShadowRequest(BaseModel):
+    path: str
+    sample: float = 0.1
+
+
+def _detect(image, level=0, camera=None):
+    """
+    Plate + vehicle recognition at a quality level, within a camera's ROI if
+    given; returns (status_code, body).
+    """
+    quality = QUALITY_LEVELS[level]
+    try:
+        # Decode once for both models
+        t = time.perf_counter()
+        img = load_image(image)
+        if img is None:
+            return 400, {"error": "Could not read the image."}
+        decode_time = time.perf_counter() - t
+
+        result = recognize_plate(img, camera=camera,
+                                 tiling=TILING if quality["tiled"] else None,
+                                 **quality["recognize"])
+        result.timings["decode"] = decode_time
+
+        if quality["skip_vehicle"]:
+            type = None
+        else:
+            t = time.perf_counter()
+            type = detect_vehicle(img, plate_bbox=result.bbox, from_plate=VEHICLE_FROM_PLATE)
+            result.timings["vehicle"] = time.perf_counter() - t
+            if type is None:
+                return 422, {"error": "No valid vehicle detected"}
+
+        if not result.ok:
+            # Semantic failure — image ok, but no plate detected
+            return 422, {"error": "No valid plate detected", "reason": result.failure.value,
+                         "details": result.to_dict()}
+
+        return 200, {"plate": result.text, "type": type, "details": result.to_dict()}
+
+    except Exception as e:
+        # Likely malformed image or server issue
+        return 400, {"error": str(e)}
 
 
 @app.post("/api/detect")
-async def detect_plate(req: ImageRequest):
+async def detect_plate(req: ImageRequest, request: Request,
+                       x_priority: str = Header(DEFAULT_PRIORITY)):
     """
     Accepts:
         {
-            "image_base64": "data:image/jpeg;base64,...."
+            "image_base64": "data:image/jpeg;base64,....",
+            "camera_id": "gate-1",    # optional: detect within this camera's ROI
+            "watchlist": true         # optional: check the plate against the watchlists
         }
+        Optional "X-Priority: high|low" header; live traffic is served first.
     Returns:
-        200: {"plate": "MH12AB1234", "type": "car"}
-        422: {"error": "No valid plate detected"}
+        200: {"plate": "MH12AB1234", "type": "car", "details": {...}, "quality": 0}
+        422: {"error": "No valid plate detected", "reason": "no_plate", "details": {...}}
         400: {"error": "Invalid image input"}
+        429: {"error": "Server busy"} when ANPR_MAX_QUEUE requests are already waiting
+    "details" is the PlateResult: bbox, confidences, OCR variant/psm and stage timings.
+    "quality" is the rung of the quality ladder used (0 = full; higher is cheaper,
+    used when the queue is long; "type" is null when vehicle typing was skipped).
+    With "watchlist", 200 responses also carry
+        "watchlist": [{"list": "stolen", "plate": "MH12A81234", "cost": 0.25}, ...]
+    (cost 0 is an exact match; confusable characters such as 8/B cost 0.25).
     """
+    return await _serve(request.app, req.image_base64, x_priority, req.camera_id, req.watchlist)
+
+
+@app.post("/api/detect/raw")
+async def detect_plate_raw(request: Request, camera_id: str | None = None,
+                           watchlist: bool = False,
+                           x_priority: str = Header(DEFAULT_PRIORITY)):
+    """
+    Same as /api/detect, with the encoded image (JPEG, PNG, ...) as the request
+    body instead of base64 JSON, and camera_id/watchlist as query parameters.
+    """
+    return await _serve(request.app, await request.body(), x_priority, camera_id, watchlist)
+
+
+async def _serve(app, image, x_priority, camera_id, watchlist):
+    """Shared body of the /api/detect routes."""
     try:
-        plate = detect_and_ocr(req.image_base64)
-        type = detect_vehicle(req.image_base64)
-        
-        if type is None:
-            return JSONResponse(
-                {"error": "No valid vehicle detected"},
-                status_code=422
-            )
-
-        if plate == "Invalid plate":
-            # Semantic failure — image ok, but no plate detected
-            return JSONResponse(
-                {"error": "No valid plate detected"},
-                status_code=422
-            )
+        priority = Priority[x_priority.upper()]
+    except KeyError:
+        return JSONResponse({"error": "X-Priority must be 'high' or 'low'"}, status_code=400)
+    if MAX_QUEUE and app.state.scheduler.depth() >= MAX_QUEUE:
+        return JSONResponse({"error": "Server busy"}, status_code=429,
+                            headers={"Retry-After": "1"})
+
+    (status, body), level = await _recognize(app, image, priority, camera_id, watchlist,
+                                             record=True)
+    return JSONResponse({**body, "quality": level}, status_code=status,
+                        headers={"X-Quality-Level": str(level)})
+
+
+async def _recognize(app, image, priority, camera_id=None, watchlist=False, record=False):
+    """
+    Schedule _detect(); identical images already in flight share one run.
+    With `record`, a plate read is added to the sightings store, once per run.
+    Returns ((status, body), quality level).
+    """
+    camera = app.state.cameras.get(camera_id) if camera_id else None
 
-        return JSONResponse({"plate": plate, "type": type}, status_code=200)
+    async def run():
+        (status, body), level = await app.state.scheduler.submit(
+            lambda level: _detect(image, level, camera), priority)
+        if record and status == 200 and app.state.sightings is not None:
+            app.state.sightings.record(body["plate"], camera_id,
+                                       det_conf=body["details"]["det_conf"],
+                                       ocr_conf=body["details"]["ocr_conf"])
+        return (status, body), level
 
+    (status, body), level = await app.state.flights.run(
+        (priority, camera_id, content_key(image)), run)
+    if status != 400:
+        app.state.models.observe(image)  # shadow-mode sampling, if enabled
+    if watchlist and status == 200:
+        # A new dict: coalesced callers share `body`
+        body = {**body, "watchlist": [
+            {"list": name, "plate": m.plate, "cost": m.cost}
+            for name, wl in app.state.watchlists.items() for m in wl.match(body["plate"])
+        ]}
+    return (status, body), level
+
+
+@app.websocket("/ws/stream/{camera_id}")
+async def stream(websocket: WebSocket, camera_id: str, watchlist: bool = False,
+                 frames: bool = False):
+    """
+    One long-lived connection per camera. Send each frame as a binary message
+    (encoded JPEG/PNG). Frames are recognized with the camera's ROI at high
+    priority; when recognition falls behind, only the newest frame waiting is
+    processed and older ones are dropped. Pushes a JSON message per new plate:
+        {"event": "plate", "frame": 42, "plate": "MH12AB1234", "type": "car",
+         "details": {...}, "quality": 0, "latency_ms": 180.5, "dropped": 3}
+    The same plate is not reported again within ANPR_STREAM_REPEAT seconds.
+    With ?watchlist=true events carry "watchlist" hits; with ?frames=true a
+    {"event": "frame", "frame", "status", ...} message is also sent for every
+    processed frame. "frame" numbers count received frames from 1.
+    """
+    await websocket.accept()
+    app = websocket.app
+    state = {"latest": None, "received": 0, "dropped": 0}
+    ready = asyncio.Event()
+
+    async def receive():
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                return
+            data = message.get("bytes")
+            if not data:
+                continue  # text messages are ignored
+            state["received"] += 1
+            if state["latest"] is not None:
+                state["dropped"] += 1  # latest frame wins
+            state["latest"] = (state["received"], data, time.monotonic())
+            ready.set()
+
+    async def process():
+        last_seen = {}  # plate -> monotonic time last reported
+        while True:
+            await ready.wait()
+            ready.clear()
+            seq, data, received = state["latest"]
+            state["latest"] = None
+
+            (status, body), level = await _recognize(app, data, Priority.HIGH, camera_id,
+                                                     watchlist, record=True)
+            now = time.monotonic()
+            info = {"frame": seq, "quality": level,
+                    "latency_ms": round((now - received) * 1000, 1), "dropped": state["dropped"]}
+            if frames:
+                await websocket.send_json({"event": "frame", "status": status, **body, **info})
+            if status == 200 and now - last_seen.get(body["plate"], -STREAM_REPEAT) >= STREAM_REPEAT:
+                await websocket.send_json({"event": "plate", **body, **info})
+            if status == 200:
+                last_seen[body["plate"]] = now
+            for plate in [p for p, t in last_seen.items() if now - t >= STREAM_REPEAT]:
+                del last_seen[plate]
+
+    receiver = asyncio.create_task(receive())
+    processor = asyncio.create_task(process())
+    try:
+        # Ends when the client disconnects, or when sending fails
+        await asyncio.wait([receiver, processor], return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        receiver.cancel()
+        processor.cancel()
+        await asyncio.gather(receiver, processor, return_exceptions=True)
+
+
+@app.get("/api/metrics")
+async def metrics(request: Request):
+    """
+    Returns:
+        200: {"queue_depth": 0, "computed": 10, "coalesced": 3, "in_flight": 1,
+              "sightings": {"written": 9, "pending": 1, "dropped": 0, "failed": 0,
+                            "last_error": null}}
+    "coalesced" counts requests that shared an identical in-flight image's result.
+    "sightings" is null when the store is off.
+    """
+    sightings = request.app.state.sightings
+    return {"queue_depth": request.app.state.scheduler.depth(),
+            **request.app.state.flights.stats(),
+            "sightings": sightings.stats() if sightings is not None else None}
+
+
+@app.get("/api/sightings")
+async def get_sightings(request: Request, plate: str | None = None, match: str = "exact",
+                        camera: str | None = None, since: float | None = None,
+                        until: float | None = None, hours: float | None = None,
+                        limit: int = Query(100, ge=1, le=SIGHTINGS_MAX_LIMIT)):
+    """
+    Where and when plates were read, newest first, e.g.
+        /api/sightings?plate=MH12AB1234&match=fuzzy&hours=24
+    match: "exact", "prefix" (plates starting with `plate`) or "fuzzy" (equal up
+    to confusable characters such as 0/O and 8/B). since/until are unix times;
+    hours=N is since N hours ago; limit is at most 1000.
+    Returns:
+        200: [{"ts": 1700000000.5, "camera": "gate-1", "plate": "MH12AB1234",
+               "det_conf": 0.91, "ocr_conf": 87.0}, ...]   ("cost" added for fuzzy)
+        400: {"error": "..."} for an unknown match
+        422: limit outside 1..1000
+        404: {"error": "..."} when ANPR_SIGHTINGS_DB is not set
+    """
+    store = request.app.state.sightings
+    if store is None:
+        return JSONResponse({"error": "Sightings are not recorded (set ANPR_SIGHTINGS_DB)"},
+                            status_code=404)
+    if match not in MATCHES:
+        return JSONResponse({"error": f"match must be one of {', '.join(MATCHES)}"},
+                            status_code=400)
+    if hours is not None:
+        since = time.time() - hours * 3600
+    return await run_in_threadpool(store.query, plate, match, camera, since, until, limit)
+
+
+@app.get("/api/cameras")
+async def get_cameras(request: Request):
+    """
+    Returns:
+        200: {"gate-1": {"roi": [x1, y1, x2, y2], "declared": true, "fallback": true,
+                         "samples": 120, "hits": 118, "misses": 2}, ...}
+    "roi" is in fractions of the frame; null while a camera is still learning it.
+    """
+    return request.app.state.cameras.status()
+
+
+def _admin_denied(token):
+    if not ADMIN_TOKEN:
+        return JSONResponse({"error": "Admin API disabled (set ANPR_ADMIN_TOKEN)"},
+                            status_code=403)
+    if token is None or not hmac.compare_digest(token.encode(), ADMIN_TOKEN.encode()):
+        return JSONResponse({"error": "Admin token required"}, status_code=403)
+    return None
+
+
+@app.get("/api/admin/models")
+async def get_models(request: Request, x_admin_token: str | None = Header(None)):
+    """
+    Returns:
+        200: {"plate": {"path", "version", "loaded_at", "error", "shadow"}, "vehicle": ..., "tessdata": ...}
+    "version" is the SHA-1 of the live model file; "shadow" holds the candidate's
+    agreement with the live model and both latencies when shadow mode is on.
+    """
+    return _admin_denied(x_admin_token) or request.app.state.models.status()
+
+
+@app.post("/api/admin/models/{name}/reload")
+async def reload_model(name: str, request: Request, x_admin_token: str | None = Header(None)):
+    """
+    Load, warm and swap in the current file of model `name` (plate, vehicle or
+    tessdata) now instead of waiting for the file watcher.
+    Returns:
+        200: the model's status; "error" is set (and the old model kept) if loading failed
+    """
+    if denied := _admin_denied(x_admin_token):
+        return denied
+    if name not in KINDS:
+        return JSONResponse({"error": f"Unknown model '{name}'"}, status_code=404)
+    return await run_in_threadpool(request.app.state.models.reload, name)
+
+
+@app.post("/api/admin/models/{name}/shadow")
+async def start_shadow(name: str, req: ShadowRequest, request: Request,
+                       x_admin_token: str | None = Header(None)):
+    """
+    Accepts:
+        {"path": "/models/candidate.pt", "sample": 0.1}
+    Runs the candidate beside the live model on `sample` of traffic, off the request path.
+    """
+    if denied := _admin_denied(x_admin_token):
+        return denied
+    if name not in KINDS:
+        return JSONResponse({"error": f"Unknown model '{name}'"}, status_code=404)
+    try:
+        return await run_in_threadpool(request.app.state.models.start_shadow,
+                                       name, req.path, req.sample)
     except Exception as e:
-        # Likely malformed image or server issue
         return JSONResponse({"error": str(e)}, status_code=400)
 
 
+@app.delete("/api/admin/models/{name}/shadow")
+async def stop_shadow(name: str, request: Request, x_admin_token: str | None = Header(None)):
+    """Stop shadow mode; returns the final comparison report."""
+    if denied := _admin_denied(x_admin_token):
+        return denied
+    report = request.app.state.models.stop_shadow(name)
+    if report is None:
+        return JSONResponse({"error": f"No shadow running for '{name}'"}, status_code=404)
+    return report
+
+
+async def _job_worker(app):
+    """Drain the job queue in the background at low priority, one image at a time."""
+    jobs, ready = app.state.jobs, app.state.jobs_ready
+    while True:
+        # Clear before claiming so a submit that lands in between still wakes us
+        ready.clear()
+        item = await run_in_threadpool(jobs.claim)
+        if item is None:
+            await ready.wait()
+            continue
+        job_id, idx, image = item
+        try:
+            (status, body), level = await _recognize(app, image, Priority.LOW)
+            result = {"status": status, **body, "quality": level}
+        except Exception as e:
+            result = {"status": 500, "error": str(e), "quality": None}
+        try:
+            await run_in_threadpool(jobs.complete, job_id, idx, result)
+        except Exception as e:
+            # Left running; recover() requeues it on the next start
+            print(f"Job {job_id} item {idx}: could not store the result: {e}")
+            await asyncio.sleep(JOB_STREAM_POLL)
+
+
+@app.post("/api/jobs", status_code=202)
+async def submit_job(req: JobRequest, request: Request):
+    """
+    Accepts:
+        {"images": ["data:image/jpeg;base64,....", ...], "priority": 0}
+    Returns immediately:
+        202: {"job_id": "...", "total": 2}
+    Images are processed in the background; poll GET /api/jobs/{job_id}.
+    """
+    if not req.images:
+        return JSONResponse({"error": "No images given"}, status_code=400)
+    job_id = await run_in_threadpool(request.app.state.jobs.submit, req.images, req.priority)
+    request.app.state.jobs_ready.set()
+    return {"job_id": job_id, "total": len(req.images)}
+
+
+@app.get("/api/jobs/{job_id}")
+async def get_job(job_id: str, request: Request, stream: bool = False):
+    """
+    Returns:
+        200: {"job_id", "status": "pending"|"done", "total", "done",
+              "results": [{"index": 0, "status": 200, "plate": ..., ...}, ...]}
+        404: {"error": "Unknown job"}
+    With ?stream=true, completed items are streamed as NDJSON, one
+    {"index", "status", ...} object per line, until the job is done. If no
+    item completes for ANPR_JOB_STREAM_TIMEOUT seconds, the stream ends with
+    {"error": "Timed out waiting for results", "done": 3, "total": 10}.
+    """
+    jobs = request.app.state.jobs
+    status = await run_in_threadpool(jobs.status, job_id)
+    if status is None:
+        return JSONResponse({"error": "Unknown job"}, status_code=404)
+
+    if not stream:
+        results = await run_in_threadpool(jobs.results, job_id)
+        status["results"] = [{"index": idx, **result} for _, idx, result in results]
+        return status
+
+    async def ndjson():
+        seq, sent = 0, 0
+        progress = time.monotonic()
+        while True:
+            for seq, idx, result in await run_in_threadpool(jobs.results, job_id, seq):
+                sent += 1
+                progress = time.monotonic()
+                yield json.dumps({"index": idx, **result}) + "\n"
+            if sent >= status["total"]:
+                return
+            if time.monotonic() - progress >= JOB_STREAM_TIMEOUT:
+                yield json.dumps({"error": "Timed out waiting for results",
+                                  "done": sent, "total": status["total"]}) + "\n"
+                return
+            await asyncio.sleep(JOB_STREAM_POLL)
+
+    return StreamingResponse(ndjson(), media_type="application/x-ndjson")
+
+
 @app.get("/")
 async def root():
     return {"message": "ANPR API is running"}